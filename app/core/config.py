@@ -1,4 +1,6 @@
 # core/config.py
+from typing import Literal
+
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -6,12 +8,169 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 class Settings(BaseSettings):
     NATS_URL: str = Field("nats://nats.resto-app.pl:4222", env="NATS_URL")
     LOG_DIR: str = Field("logs", env="LOG_DIR")
+    LOG_LEVEL: str = Field("INFO", env="LOG_LEVEL")
+    LOG_JSON: bool = Field(False, env="LOG_JSON")
+    # per-message logs: 1 of every N per subject, at most LIMIT/s per subject
+    LOG_SAMPLE_EVERY: int = Field(1, env="LOG_SAMPLE_EVERY")
+    LOG_RATE_LIMIT: int = Field(5, env="LOG_RATE_LIMIT")
     BACKEND_API_URL: str = Field("http://smart-api.resto-app.pl", env="BACKEND_API_URL")
     SUBJECT: str = Field(
         "device_communication.>",
         env="SUBJECT",
     )
 
+    # Forward NATS payloads as-is (raw bytes spliced into the WS envelope)
+    NATS_PASSTHROUGH: bool = Field(True, env="NATS_PASSTHROUGH")
+    # Validate every N-th passthrough payload as JSON (0 = never, 1 = always);
+    # payloads stored for replay (LVC / history) are always validated
+    NATS_VALIDATE_EVERY: int = Field(100, env="NATS_VALIDATE_EVERY")
+
+    # Broad NATS subscriptions held for the gateway lifetime, e.g.
+    # ["device_communication.>"]; client subjects they cover are routed
+    # in-process instead of opening one NATS subscription each.
+    NATS_BROAD_SUBJECTS: list[str] = Field([], env="NATS_BROAD_SUBJECTS")
+    # Cached subject -> subscribers resolutions for wildcard routing
+    SUBJECT_MATCH_CACHE_SIZE: int = Field(10_000, env="SUBJECT_MATCH_CACHE_SIZE")
+
+    # Per-connection outbound queue (slow-consumer handling)
+    WS_QUEUE_SIZE: int = Field(256, env="WS_QUEUE_SIZE")
+    WS_OVERFLOW_POLICY: Literal["drop_oldest", "drop_newest", "disconnect"] = Field(
+        "drop_oldest",
+        env="WS_OVERFLOW_POLICY",
+    )
+    # "disconnect" policy: close the connection after this many drops
+    WS_MAX_DROPS: int = Field(1000, env="WS_MAX_DROPS")
+
+    # keep NATS subscription + defer control `stop` this long after the
+    # last WS subscriber of a subject left (0 = stop immediately)
+    WS_LINGER_SECONDS: float = Field(5.0, env="WS_LINGER_SECONDS")
+
+    # Resumable sessions: keep a dropped connection's subscriptions for
+    # SESSION_TTL seconds (0 = off), buffering up to SESSION_BUFFER frames
+    SESSION_TTL: float = Field(0.0, env="SESSION_TTL")
+    SESSION_BUFFER: int = Field(256, env="SESSION_BUFFER")
+
+    # WS -> NATS publish / request commands: allowed subject prefixes
+    # (empty = commands disabled), request timeouts and per-connection
+    # in-flight limit
+    WS_PUBLISH_PREFIXES: list[str] = Field([], env="WS_PUBLISH_PREFIXES")
+    WS_REQUEST_TIMEOUT: float = Field(5.0, env="WS_REQUEST_TIMEOUT")
+    WS_REQUEST_MAX_TIMEOUT: float = Field(30.0, env="WS_REQUEST_MAX_TIMEOUT")
+    WS_MAX_INFLIGHT: int = Field(32, env="WS_MAX_INFLIGHT")
+
+    # upper bound for per-subscription max_rate (messages/s)
+    WS_MAX_RATE: float = Field(100.0, env="WS_MAX_RATE")
+
+    # Micro-batching (opt-in per connection via hello): pack queued
+    # messages into one JSON / msgpack array frame
+    WS_BATCH_WINDOW_MS: float = Field(0.0, env="WS_BATCH_WINDOW_MS")
+    WS_BATCH_MAX: int = Field(64, env="WS_BATCH_MAX")
+    WS_BATCH_MAX_WINDOW_MS: float = Field(100.0, env="WS_BATCH_MAX_WINDOW_MS")
+    # message types that flush a pending batch immediately
+    WS_BATCH_FLUSH_TYPES: list[str] = Field(
+        ["raspberry_heartbeat"], env="WS_BATCH_FLUSH_TYPES"
+    )
+
+    # permessage-deflate: shared (compress once) | deflate | off
+    WS_COMPRESSION: Literal["shared", "deflate", "off"] = Field(
+        "shared", env="WS_COMPRESSION"
+    )
+    WS_COMPRESSION_MIN_SIZE: int = Field(256, env="WS_COMPRESSION_MIN_SIZE")
+    # compressed messages kept for reuse across subscribers (count and
+    # total compressed bytes)
+    WS_COMPRESSION_CACHE_SIZE: int = Field(1024, env="WS_COMPRESSION_CACHE_SIZE")
+    WS_COMPRESSION_CACHE_BYTES: int = Field(
+        8_000_000, env="WS_COMPRESSION_CACHE_BYTES"
+    )
+
+    # Last-value cache: newest frame per subject, sent on subscribe
+    LVC_ENABLED: bool = Field(True, env="LVC_ENABLED")
+    LVC_MAX_ENTRIES: int = Field(50_000, env="LVC_MAX_ENTRIES")
+    LVC_MAX_BYTES: int = Field(64_000_000, env="LVC_MAX_BYTES")
+    LVC_TTL: float = Field(300.0, env="LVC_TTL")  # seconds
+
+    # Replay history (subscribe since_seq / last_n) for subjects matching
+    # these patterns; ring buffer limits per subject and in total
+    HISTORY_SUBJECTS: list[str] = Field([], env="HISTORY_SUBJECTS")
+    HISTORY_MAX_MESSAGES: int = Field(100, env="HISTORY_MAX_MESSAGES")
+    HISTORY_MAX_BYTES: int = Field(1_000_000, env="HISTORY_MAX_BYTES")
+    HISTORY_TOTAL_BYTES: int = Field(64_000_000, env="HISTORY_TOTAL_BYTES")
+    # forget seqs / history of subjects without subscribers this long
+    HISTORY_IDLE_SECONDS: float = Field(600.0, env="HISTORY_IDLE_SECONDS")
+    # fetch messages older than the ring from JetStream (stream required)
+    HISTORY_JETSTREAM_FALLBACK: bool = Field(False, env="HISTORY_JETSTREAM_FALLBACK")
+    HISTORY_FALLBACK_LOOKBACK: float = Field(300.0, env="HISTORY_FALLBACK_LOOKBACK")
+    HISTORY_FALLBACK_TIMEOUT: float = Field(2.0, env="HISTORY_FALLBACK_TIMEOUT")
+
+    # Device marked offline after this many seconds without a heartbeat
+    DEVICE_OFFLINE_TIMEOUT: float = Field(60.0, env="DEVICE_OFFLINE_TIMEOUT")
+
+    # Device status snapshot for warm starts ("" = disabled)
+    STATUS_SNAPSHOT_PATH: str = Field(
+        "state/device_status.bin", env="STATUS_SNAPSHOT_PATH"
+    )
+    STATUS_SNAPSHOT_INTERVAL: float = Field(30.0, env="STATUS_SNAPSHOT_INTERVAL")
+    # max uuids per get_status_many request
+    STATUS_QUERY_MAX: int = Field(10_000, env="STATUS_QUERY_MAX")
+
+    # Heartbeat forwarding: "all" beats, only "status" transitions, or
+    # status / payload field "changes"; unchanged state is re-emitted at
+    # most every HEARTBEAT_KEEPALIVE seconds (0 = never)
+    HEARTBEAT_FORWARD: Literal["all", "status", "changes"] = Field(
+        "all",
+        env="HEARTBEAT_FORWARD",
+    )
+    HEARTBEAT_KEEPALIVE: float = Field(30.0, env="HEARTBEAT_KEEPALIVE")
+    # payload fields ignored by "changes" (they differ on every beat)
+    HEARTBEAT_VOLATILE_FIELDS: list[str] = Field(
+        ["timestamp", "ts", "time", "uptime"],
+        env="HEARTBEAT_VOLATILE_FIELDS",
+    )
+
+    # JetStream pull consumers (disabled while subject is empty)
+    HEARTBEAT_SUBJECT: str = Field("", env="HEARTBEAT_SUBJECT")
+    HEARTBEAT_DURABLE: str = Field("gateway-heartbeat", env="HEARTBEAT_DURABLE")
+    INVERTER_SUBJECT: str = Field("", env="INVERTER_SUBJECT")
+    INVERTER_DURABLE: str = Field("gateway-inverter", env="INVERTER_DURABLE")
+
+    PULL_MIN_BATCH: int = Field(10, env="PULL_MIN_BATCH")
+    PULL_MAX_BATCH: int = Field(500, env="PULL_MAX_BATCH")
+    PULL_FETCH_TIMEOUT: float = Field(1.0, env="PULL_FETCH_TIMEOUT")
+    PULL_CONCURRENCY: int = Field(64, env="PULL_CONCURRENCY")
+    PULL_ACK_BATCH: int = Field(100, env="PULL_ACK_BATCH")
+    PULL_ERROR_BACKOFF: float = Field(1.0, env="PULL_ERROR_BACKOFF")
+    # shutdown: wait this long for running handlers, then for pending acks
+    PULL_DRAIN_TIMEOUT: float = Field(2.0, env="PULL_DRAIN_TIMEOUT")
+    # pause fetching while this many frames wait in WS client queues
+    PULL_BACKPRESSURE_HIGH: int = Field(100_000, env="PULL_BACKPRESSURE_HIGH")
+    PULL_BACKPRESSURE_LOW: int = Field(20_000, env="PULL_BACKPRESSURE_LOW")
+    PULL_BACKPRESSURE_PAUSE: float = Field(0.05, env="PULL_BACKPRESSURE_PAUSE")
+
+    # Prometheus /metrics endpoint (workers: METRICS_PORT + worker id);
+    # local only unless METRICS_HOST says otherwise
+    METRICS_ENABLED: bool = Field(True, env="METRICS_ENABLED")
+    METRICS_HOST: str = Field("127.0.0.1", env="METRICS_HOST")
+    METRICS_PORT: int = Field(9480, env="METRICS_PORT")
+    # max label values per metric (extra values -> "__other__")
+    METRICS_MAX_SERIES: int = Field(5000, env="METRICS_MAX_SERIES")
+
+    # Multi-process mode: N workers share the WS port via SO_REUSEPORT
+    WORKERS: int = Field(1, env="WORKERS")
+    WORKER_RESTART_DELAY: float = Field(1.0, env="WORKER_RESTART_DELAY")
+    WORKER_SHUTDOWN_TIMEOUT: float = Field(15.0, env="WORKER_SHUTDOWN_TIMEOUT")
+
+    # Cluster-wide interest for control events (several gateways behind a
+    # load balancer), coordinated through a NATS KV bucket
+    CLUSTER_INTEREST: bool = Field(False, env="CLUSTER_INTEREST")
+    CLUSTER_BUCKET: str = Field("gateway-interest", env="CLUSTER_BUCKET")
+    # "" = host-pid; characters other than [A-Za-z0-9_-] become "-"
+    CLUSTER_GATEWAY_ID: str = Field("", env="CLUSTER_GATEWAY_ID")
+    CLUSTER_LEASE: float = Field(30.0, env="CLUSTER_LEASE")
+    CLUSTER_DEBOUNCE: float = Field(0.5, env="CLUSTER_DEBOUNCE")
+
+    # Event loop: uvloop when installed
+    UVLOOP: bool = Field(True, env="UVLOOP")
+
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
 
@@ -0,0 +1,40 @@
+# app/core/jsonlib.py
+"""
+JSON backend for the gateway: orjson when installed, stdlib json
+otherwise. Output is compact (no whitespace) with either backend.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+JSONDecodeError = json.JSONDecodeError
+
+
+def dumpb(obj) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # e.g. ints beyond 64 bit: stdlib handles them
+            pass
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def dumps(obj) -> str:
+    if orjson is not None:
+        return dumpb(obj).decode()
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def loads(data):
+    """
+    Parse str / bytes. Raises JSONDecodeError (a ValueError) on bad input.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -1,44 +1,145 @@
 # app/core/logging.py
+import atexit
 import logging
 import os
+import queue
 import sys
-from logging.handlers import RotatingFileHandler
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 from app.core.config import settings
 
 LOG_DIR = settings.LOG_DIR
 os.makedirs(LOG_DIR, exist_ok=True)
-LOG_FILE_PATH = os.path.join(LOG_DIR, "logs.log")
+# worker processes (WORKERS > 1) write their own file
+WORKER_ID = os.environ.get("GATEWAY_WORKER_ID")
+LOG_FILE_NAME = f"logs.w{WORKER_ID}.log" if WORKER_ID else "logs.log"
+LOG_FILE_PATH = os.path.join(LOG_DIR, LOG_FILE_NAME)
 
+LOG_LEVEL = logging.getLevelName(settings.LOG_LEVEL.upper())
 LOG_FORMAT = "[%(asctime)s] [%(levelname)s] [%(name)s]  %(message)s"
 DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
-formatter = logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT)
+
+
+def _build_formatter() -> logging.Formatter:
+    if settings.LOG_JSON:
+        try:
+            from pythonjsonlogger import jsonlogger
+        except ImportError:
+            pass
+        else:
+            return jsonlogger.JsonFormatter(
+                "%(asctime)s %(levelname)s %(name)s %(message)s",
+                datefmt=DATE_FORMAT,
+            )
+    return logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT)
+
+
+formatter = _build_formatter()
 
 file_handler = RotatingFileHandler(
     LOG_FILE_PATH, maxBytes=10_000_000, backupCount=5, encoding="utf-8"
 )
-file_handler.setLevel(logging.INFO)
+file_handler.setLevel(LOG_LEVEL)
 file_handler.setFormatter(formatter)
 
 console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setLevel(logging.INFO)
+console_handler.setLevel(LOG_LEVEL)
 console_handler.setFormatter(formatter)
 
+# -------------------------------------------------------------------
+# Non-blocking pipeline: the event loop only enqueues records, a
+# background thread formats and writes them (file + stdout).
+# -------------------------------------------------------------------
+class _DeferredQueueHandler(QueueHandler):
+    """
+    Only %-interpolation (and a traceback, if any) runs on the event loop,
+    while the args still hold their current values; timestamps, layout
+    and I/O run in the listener thread.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+log_queue: queue.Queue = queue.Queue(-1)
+queue_handler = _DeferredQueueHandler(log_queue)
+
+queue_listener = QueueListener(
+    log_queue,
+    file_handler,
+    console_handler,
+    respect_handler_level=True,
+)
+queue_listener.start()
+atexit.register(queue_listener.stop)
+
 root_logger = logging.getLogger()
-root_logger.setLevel(logging.INFO)
+root_logger.setLevel(LOG_LEVEL)
 
 for handler in list(root_logger.handlers):
     root_logger.removeHandler(handler)
 
-root_logger.addHandler(file_handler)
-root_logger.addHandler(console_handler)
+root_logger.addHandler(queue_handler)
 
 for name in ["uvicorn", "uvicorn.error", "uvicorn.access"]:
     log = logging.getLogger(name)
     log.handlers = root_logger.handlers
-    log.setLevel(logging.INFO)
+    log.setLevel(LOG_LEVEL)
     log.propagate = False
 
-root_logger.info(f"Logging initialized. Writing logs to: {LOG_FILE_PATH}")
+root_logger.info("Logging initialized. Writing logs to: %s", LOG_FILE_PATH)
 
 logger = logging.getLogger("app")
+
+
+# -------------------------------------------------------------------
+# Per-message log sampling / rate limiting
+# -------------------------------------------------------------------
+
+class LogSampler:
+    """
+    Decides whether a per-message log line for `key` (e.g. a subject)
+    should be emitted: 1 of every `every` messages per key, at most
+    `limit` lines per key per second. Counters reset every second, so
+    memory stays bounded by the keys seen in one window.
+    """
+
+    def __init__(self, every: int, limit: int):
+        self._every = max(1, every)
+        self._limit = limit
+        self._window = 0
+        self._counts: dict = {}
+
+    def allow(self, key) -> bool:
+        window = int(time.monotonic())
+        if window != self._window:
+            self._window = window
+            self._counts.clear()
+
+        count = self._counts.get(key, 0)
+        self._counts[key] = count + 1
+
+        if count % self._every:
+            return False
+        return count // self._every < self._limit
+
+
+log_sampler = LogSampler(
+    every=settings.LOG_SAMPLE_EVERY,
+    limit=settings.LOG_RATE_LIMIT,
+)
+
+
+def log_sampled(level: int, key, msg: str, *args):
+    """
+    Lazy, sampled per-message log: nothing is formatted when the level
+    is disabled or the sample for key is skipped.
+    """
+    if logger.isEnabledFor(level) and log_sampler.allow(key):
+        logger.log(level, msg, *args)
@@ -0,0 +1,19 @@
+# app/core/loop.py
+import asyncio
+
+from app.core.config import settings
+from app.core.logging import logger
+
+
+def run(main):
+    """
+    asyncio.run() on uvloop (UVLOOP=true, the default) when installed.
+    """
+    if settings.UVLOOP:
+        try:
+            import uvloop
+        except ImportError:
+            logger.warning("uvloop not installed, using the default asyncio loop")
+        else:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return asyncio.run(main)
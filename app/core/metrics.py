@@ -0,0 +1,219 @@
+# app/core/metrics.py
+"""
+Minimal in-process metrics with Prometheus text exposition.
+
+Counters / histograms are plain attribute updates (cheap enough for the
+per-message path); gauges are computed by callbacks at scrape time.
+"""
+import asyncio
+from bisect import bisect_left
+
+from app.core.config import settings
+from app.core.logging import logger
+
+OTHER_LABEL = "__other__"
+
+_registry: list = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """
+    Monotonic counter, optionally with one label. The number of label
+    values is capped (METRICS_MAX_SERIES); extra values are folded into
+    `__other__`.
+    """
+
+    def __init__(self, name: str, help: str, label: str | None = None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._values: dict = {}
+        _registry.append(self)
+
+    def inc(self, label_value=None, amount: float = 1):
+        values = self._values
+        if label_value in values:
+            values[label_value] += amount
+        elif len(values) < settings.METRICS_MAX_SERIES:
+            values[label_value] = amount
+        else:
+            values[OTHER_LABEL] = values.get(OTHER_LABEL, 0) + amount
+
+    def value(self, label_value=None) -> float:
+        return self._values.get(label_value, 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        if self.label is None:
+            lines.append(f"{self.name} {self._values.get(None, 0)}")
+            return lines
+
+        for label_value, value in self._values.items():
+            lines.append(
+                f'{self.name}{{{self.label}="{_escape(label_value)}"}} {value}'
+            )
+        return lines
+
+
+class Gauge:
+    """
+    Gauge evaluated at scrape time.
+    """
+
+    def __init__(self, name: str, help: str, fn):
+        self.name = name
+        self.help = help
+        self._fn = fn
+        _registry.append(self)
+
+    def render(self) -> list[str]:
+        try:
+            value = self._fn()
+        except Exception as e:
+            logger.warning("Metric %s failed: %s", self.name, e)
+            return []
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {value}",
+        ]
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets):
+        self.name = name
+        self.help = help
+        self._buckets = sorted(buckets)
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        _registry.append(self)
+
+    def observe(self, value: float):
+        self._counts[bisect_left(self._buckets, value)] += 1
+        self._sum += value
+        self._count += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self._buckets, self._counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self._count}')
+        lines.append(f"{self.name}_sum {self._sum}")
+        lines.append(f"{self.name}_count {self._count}")
+        return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# -------------------------------------------------------------------
+# Gateway metrics
+# -------------------------------------------------------------------
+
+nats_messages_in = Counter(
+    "gateway_nats_messages_in_total",
+    "NATS messages received, per subject",
+    label="subject",
+)
+ws_frames_out = Counter(
+    "gateway_ws_frames_out_total",
+    "WS frames delivered to clients",
+)
+ws_batched_messages = Counter(
+    "gateway_ws_batched_messages_total",
+    "Messages delivered inside micro-batch array frames",
+)
+ws_send_failed = Counter(
+    "gateway_ws_send_failed_total",
+    "WS sends that failed",
+)
+ws_frames_dropped = Counter(
+    "gateway_ws_frames_dropped_total",
+    "WS frames dropped by the slow-consumer overflow policy",
+)
+ws_deflate = Counter(
+    "gateway_ws_deflate_total",
+    "Outgoing messages by shared-deflate result (hit / miss / skipped)",
+    label="result",
+)
+ws_commands = Counter(
+    "gateway_ws_commands_total",
+    "WS publish / request commands by result",
+    label="result",
+)
+offline_events = Counter(
+    "gateway_watchdog_offline_events_total",
+    "Devices marked offline by the watchdog",
+)
+fanout_latency = Histogram(
+    "gateway_fanout_latency_seconds",
+    "Time from NATS receive to WS send",
+    buckets=(
+        0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+        0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+    ),
+)
+command_latency = Histogram(
+    "gateway_ws_request_latency_seconds",
+    "Round trip of WS request commands through NATS",
+    buckets=(
+        0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+        0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    ),
+)
+
+
+# -------------------------------------------------------------------
+# HTTP endpoint
+# -------------------------------------------------------------------
+
+async def _handle_http(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # drain headers
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=5)
+            if not line or line in (b"\r\n", b"\n"):
+                break
+
+        parts = request_line.decode("latin-1").split()
+        path = parts[1].split("?")[0] if len(parts) >= 2 else ""
+
+        if parts and parts[0] == "GET" and path == "/metrics":
+            status = "200 OK"
+            body = render().encode()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            status = "404 Not Found"
+            body = b"not found\n"
+            content_type = "text/plain"
+
+        writer.write(
+            (
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n"
+            ).encode()
+            + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.debug("Metrics request failed: %s", e)
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str, port: int, **kwargs):
+    return await asyncio.start_server(_handle_http, host=host, port=port, **kwargs)
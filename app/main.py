@@ -1,49 +1,135 @@
 import asyncio
-import json
 import signal
+import time
 import websockets
 import nats
 
+from app.core import jsonlib
 from app.core.config import settings
+from app.core.loop import run
 from app.core.logging import logger
+from app.core.metrics import Gauge, nats_messages_in, start_metrics_server
 
 from app.nats.publisher import set_nats_client
+from app.nats.cluster import start_cluster
+from app.nats.interest import set_interest_pipe
+from app.nats.linger import LingerScheduler, lingering, set_linger
 from app.ws.websocket_handler import websocket_handler
-from app.ws.send import send_to_subscribers
+from app.ws.send import send_to_subscribers, forward_nats_payload
 from app.nats.subscription_manager import NatsSubscriptionManager
+from app.nats.consumer import consumer
+from app.nats.consumer_heartbeat import heartbeat_consumer, offline_watchdog
+from app.nats.status_store import device_status, load_snapshot, snapshot_loop
+from app.ws.client import total_backlog, total_buffered
+from app.ws.codecs import SUBPROTOCOLS
+from app.ws.compression import serve_options
+from app.ws.downsample import active_samplers
+from app.ws.history import history
+from app.ws.sessions import sessions
+from app.ws.last_value import last_values
+from app.ws.subscriptions import subscribers, ws_sets
 
 
-async def start_gateway():
-    logger.info("🚀 Starting NATS → WebSocket Gateway")
+# -------------------------------------------------
+# NATS message handler (fan-out only)
+# -------------------------------------------------
+async def on_nats_msg(msg):
+    try:
+        received_at = time.perf_counter()
+        subject = msg.subject
+        nats_messages_in.inc(subject)
+
+        if settings.NATS_PASSTHROUGH:
+            await forward_nats_payload(subject, msg.data, received_at)
+            return
+
+        data = jsonlib.loads(msg.data)
+        await send_to_subscribers(
+            subject,
+            {"subject": subject, "data": data},
+            received_at,
+        )
+    except Exception as e:
+        logger.exception("NATS message handling failed: %s", e)
+
+
+async def start_gateway(worker_id: int | None = None, interest_conn=None):
+    """
+    Run one gateway. worker_id / interest_conn are set in multi-process
+    mode (see app.supervisor): the WS port is shared via SO_REUSEPORT and
+    control events go through the supervisor.
+    """
+    suffix = "" if worker_id is None else f"-w{worker_id}"
+    logger.info("🚀 Starting NATS → WebSocket Gateway%s", suffix)
+    logger.info(
+        "🧩 JSON backend: %s, WS codecs: %s", jsonlib.BACKEND, SUBPROTOCOLS
+    )
 
     # -------------------------------------------------
     # NATS connection
     # -------------------------------------------------
     nc = await nats.connect(
         settings.NATS_URL,
-        name="smart-gateway",
+        name=f"smart-gateway{suffix}",
     )
     logger.info("✅ Connected to NATS Core")
     set_nats_client(nc)
+    cluster = None
+    if interest_conn is not None:
+        # worker mode: the supervisor coordinates with the cluster
+        set_interest_pipe(interest_conn)
+    else:
+        cluster = await start_cluster(nc)
 
     # -------------------------------------------------
-    # NATS message handler (fan-out only)
+    # Subscription manager (CONTROL PLANE)
     # -------------------------------------------------
-    async def on_nats_msg(msg):
-        try:
-            subject = msg.subject
-            data = json.loads(msg.data.decode())
-            await send_to_subscribers(
-                subject,
-                {"subject": subject, "data": data},
-            )
-        except Exception as e:
-            logger.exception(f"NATS message handling failed: {e}")
+    nats_manager = NatsSubscriptionManager(
+        nc,
+        on_nats_msg,
+        broad_subjects=settings.NATS_BROAD_SUBJECTS,
+    )
+    await nats_manager.start_broad()
+
+    linger = None
+    if settings.WS_LINGER_SECONDS > 0:
+        linger = LingerScheduler(nats_manager, settings.WS_LINGER_SECONDS)
+        set_linger(linger)
+        logger.info("⏳ Unsubscribe grace period %ss", settings.WS_LINGER_SECONDS)
 
     # -------------------------------------------------
-    # Subscription manager (CONTROL PLANE)
+    # JetStream consumers + offline watchdog
     # -------------------------------------------------
-    nats_manager = NatsSubscriptionManager(nc, on_nats_msg)
+    # warm start: statuses known before the first heartbeat
+    load_snapshot(device_status)
+
+    background = [asyncio.create_task(offline_watchdog.run())]
+    if settings.STATUS_SNAPSHOT_PATH:
+        background.append(asyncio.create_task(snapshot_loop(device_status)))
+    if linger is not None:
+        background.append(asyncio.create_task(linger.run()))
+
+    js = nc.jetstream()
+    if settings.HISTORY_JETSTREAM_FALLBACK:
+        history.attach_jetstream(js)
+        logger.info("📜 History fallback via JetStream enabled")
+
+    if settings.HEARTBEAT_SUBJECT:
+        hb_sub = await js.pull_subscribe(
+            settings.HEARTBEAT_SUBJECT,
+            # every worker needs every heartbeat -> own durable
+            durable=f"{settings.HEARTBEAT_DURABLE}{suffix}",
+        )
+        background.append(asyncio.create_task(heartbeat_consumer(hb_sub)))
+        logger.info("💓 Heartbeat consumer on %s", settings.HEARTBEAT_SUBJECT)
+
+    if settings.INVERTER_SUBJECT:
+        inv_sub = await js.pull_subscribe(
+            settings.INVERTER_SUBJECT,
+            durable=f"{settings.INVERTER_DURABLE}{suffix}",
+        )
+        background.append(asyncio.create_task(consumer(inv_sub)))
+        logger.info("⚡ Inverter consumer on %s", settings.INVERTER_SUBJECT)
 
     # -------------------------------------------------
     # WebSocket server
@@ -55,10 +141,90 @@ async def start_gateway():
         ping_interval=30,
         ping_timeout=10,
         max_queue=32,
+        subprotocols=SUBPROTOCOLS,
+        reuse_port=worker_id is not None,
+        **serve_options(),
     )
 
     logger.info("🌐 WebSocket ready at ws://0.0.0.0:8765")
 
+    # -------------------------------------------------
+    # Metrics
+    # -------------------------------------------------
+    Gauge(
+        "gateway_ws_connections",
+        "Active WS connections",
+        lambda: len(ws_sets),
+    )
+    Gauge(
+        "gateway_ws_subscriptions",
+        "WS subscriptions (client x subject)",
+        lambda: sum(len(subjects) for subjects in ws_sets.values()),
+    )
+    Gauge(
+        "gateway_subjects_active",
+        "Subjects / patterns with at least one WS subscriber",
+        lambda: len(subscribers),
+    )
+    Gauge(
+        "gateway_nats_subscriptions",
+        "Active NATS subscriptions",
+        lambda: nats_manager.subscription_count,
+    )
+    Gauge(
+        "gateway_ws_backlog",
+        "Frames queued in WS writers",
+        total_backlog,
+    )
+    Gauge(
+        "gateway_downsample_groups",
+        "Active rate-limited subscription groups",
+        active_samplers,
+    )
+    Gauge(
+        "gateway_last_value_entries",
+        "Subjects held in the last-value cache",
+        lambda: len(last_values),
+    )
+    Gauge(
+        "gateway_history_messages",
+        "Messages held in replay history buffers",
+        history.buffered,
+    )
+    Gauge(
+        "gateway_lingering_subjects",
+        "Subjects waiting out the unsubscribe grace period",
+        lingering,
+    )
+    Gauge(
+        "gateway_sessions_suspended",
+        "Disconnected sessions kept for resume",
+        lambda: sessions.suspended,
+    )
+    Gauge(
+        "gateway_sessions_buffered",
+        "Frames buffered for suspended sessions",
+        total_buffered,
+    )
+    Gauge(
+        "gateway_devices_known",
+        "Devices in the status store",
+        lambda: len(device_status),
+    )
+
+    metrics_server = None
+    if settings.METRICS_ENABLED:
+        # one scrape target per worker
+        metrics_port = settings.METRICS_PORT + (worker_id or 0)
+        metrics_server = await start_metrics_server(
+            settings.METRICS_HOST, metrics_port
+        )
+        logger.info(
+            "📈 Metrics at http://%s:%s/metrics",
+            settings.METRICS_HOST,
+            metrics_port,
+        )
+
     # -------------------------------------------------
     # Graceful shutdown
     # -------------------------------------------------
@@ -78,11 +244,36 @@ async def start_gateway():
     # Cleanup
     # -------------------------------------------------
     logger.info("🔻 Shutting down gateway...")
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+
     ws_server.close()
     await ws_server.wait_closed()
+    await sessions.expire_all()
+    if linger is not None:
+        # disconnected clients' subjects: stop now, not after the period
+        await linger.flush()
+    if cluster is not None:
+        await cluster.close()
+    if metrics_server is not None:
+        metrics_server.close()
+        await metrics_server.wait_closed()
     await nc.close()
     logger.info("👋 Gateway stopped")
 
 
+def run_worker(worker_id: int, interest_conn):
+    """
+    Entry point of a supervisor-spawned worker process.
+    """
+    run(start_gateway(worker_id, interest_conn))
+
+
 if __name__ == "__main__":
-    asyncio.run(start_gateway())
+    if settings.WORKERS > 1:
+        from app.supervisor import run_supervisor
+
+        run_supervisor(settings.WORKERS)
+    else:
+        run(start_gateway())
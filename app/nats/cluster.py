@@ -0,0 +1,352 @@
+# app/nats/cluster.py
+"""
+Cluster-wide interest for control `start` / `stop` events
+(CLUSTER_INTEREST).
+
+Several gateways behind a load balancer each know only their own WS
+clients. With cluster interest enabled, the process that owns control
+events (the gateway, or the supervisor in worker mode) records its
+interest in a NATS KV bucket and watches everybody else's:
+
+    s.<subject>.<gateway>  -> gateway holds interest in subject
+    g.<gateway>            -> gateway lease, refreshed every lease / 3
+
+`start` is published only when no other live gateway holds the subject,
+`stop` only when the last one releases it. Local changes are debounced
+(CLUSTER_DEBOUNCE): a start/stop flip-flop inside one window is dropped,
+and a stop is confirmed one window after the release so a concurrent
+acquire on another gateway has reached the watch.
+
+Gateways whose lease expires (crash, network split) are dropped; the
+lowest live gateway id publishes `stop` for subjects nobody else holds
+and purges the dead gateway's keys.
+"""
+import asyncio
+import os
+import re
+import socket
+import time
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.nats.publisher import publish_events
+from app.nats.subjects import is_wildcard
+
+_KEY_RE = re.compile(r"^[-/_=.a-zA-Z0-9]+$")
+
+_cluster: "ClusterInterest | None" = None
+
+
+def _safe_gateway_id(value: str) -> str:
+    # the gateway id is the last token of `s.<subject>.<gateway>`
+    return re.sub(r"[^A-Za-z0-9_-]", "-", value)
+
+
+def default_gateway_id() -> str:
+    return _safe_gateway_id(f"{socket.gethostname()}-{os.getpid()}")
+
+
+class ClusterInterest:
+    def __init__(self, js, gateway_id: str, lease: float, debounce: float):
+        self._js = js
+        self._kv = None
+        self.gateway_id = _safe_gateway_id(gateway_id)
+        if self.gateway_id != gateway_id:
+            logger.warning(
+                "[cluster] gateway id %r contains characters not allowed in "
+                "KV key tokens, using %r",
+                gateway_id,
+                self.gateway_id,
+            )
+        self._lease = lease
+        self._debounce = debounce
+
+        # subject -> gateway ids holding it (from the watch, incl. self)
+        self._holders: dict[str, set[str]] = {}
+        # gateway id -> time.monotonic() of its last lease refresh seen
+        self._leases: dict[str, float] = {}
+
+        # local interest: committed to KV / requested since last flush
+        self._held: set[str] = set()
+        self._pending: dict[str, bool] = {}
+        # released subjects whose stop is confirmed on the next flush
+        self._unconfirmed: list[str] = []
+
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+        self._watcher = None
+
+    # ---------------------------------------------------------
+    # Lifecycle
+    # ---------------------------------------------------------
+
+    async def start(self):
+        from nats.js.errors import BucketNotFoundError
+
+        try:
+            self._kv = await self._js.key_value(settings.CLUSTER_BUCKET)
+        except BucketNotFoundError:
+            self._kv = await self._js.create_key_value(
+                bucket=settings.CLUSTER_BUCKET, history=1
+            )
+
+        await self._beat()
+        self._watcher = await self._kv.watchall()
+        self._tasks = [
+            asyncio.create_task(self._watch()),
+            asyncio.create_task(self._run()),
+        ]
+        logger.info(
+            "[cluster] gateway %s joined interest bucket %s",
+            self.gateway_id,
+            settings.CLUSTER_BUCKET,
+        )
+
+    async def close(self):
+        """
+        Publish pending changes, confirm stops and leave the cluster.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        await self._flush(confirm_now=True)
+
+        held, self._held = list(self._held), set()
+        await self._write([], held)
+        await self._delete(f"g.{self.gateway_id}")
+        try:
+            await self._watcher.stop()
+        except Exception:
+            pass
+        logger.info("[cluster] gateway %s left", self.gateway_id)
+
+    # ---------------------------------------------------------
+    # Local interest
+    # ---------------------------------------------------------
+
+    def update(self, action: str, subjects) -> list[str]:
+        """
+        Queue local interest changes (debounced).
+
+        Returns:
+            subjects that cannot be coordinated (wildcards / key-unsafe
+            names) -> caller publishes them directly
+        """
+        local = []
+        for subject in subjects:
+            if is_wildcard(subject) or not _KEY_RE.match(subject):
+                local.append(subject)
+            else:
+                self._pending[subject] = action == "start"
+        self._wakeup.set()
+        return local
+
+    def _others(self, subject: str) -> bool:
+        """
+        Does any other live gateway hold subject?
+        """
+        holders = self._holders.get(subject)
+        if not holders:
+            return False
+        return any(gw != self.gateway_id and self._alive(gw) for gw in holders)
+
+    def _alive(self, gateway_id: str) -> bool:
+        seen = self._leases.get(gateway_id)
+        return seen is not None and time.monotonic() - seen < self._lease
+
+    # ---------------------------------------------------------
+    # Flush (debounced)
+    # ---------------------------------------------------------
+
+    async def _run(self):
+        interval = self._lease / 3
+        next_beat = time.monotonic() + interval
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(),
+                    timeout=max(0.0, next_beat - time.monotonic()),
+                )
+            except asyncio.TimeoutError:
+                pass
+
+            if self._wakeup.is_set():
+                self._wakeup.clear()
+                # collect the rest of the burst
+                await asyncio.sleep(self._debounce)
+                await self._flush()
+
+            if time.monotonic() >= next_beat:
+                next_beat = time.monotonic() + interval
+                await self._beat()
+                await self._reap_dead()
+
+    async def _flush(self, confirm_now: bool = False):
+        changes, self._pending = self._pending, {}
+        acquire = [s for s, want in changes.items() if want and s not in self._held]
+        release = [s for s, want in changes.items() if not want and s in self._held]
+
+        # stops released one window ago: still nobody holding them?
+        candidates, self._unconfirmed = set(self._unconfirmed), []
+        self._held.update(acquire)
+        self._held.difference_update(release)
+
+        stop = [
+            s for s in candidates if s not in self._held and not self._others(s)
+        ]
+        # re-acquired before its stop was confirmed -> never stopped
+        start = [s for s in acquire if s not in candidates and not self._others(s)]
+
+        await self._write(acquire, release)
+        if start:
+            await publish_events(start, "start")
+        if stop:
+            await publish_events(stop, "stop")
+
+        unconfirmed = [s for s in release if not self._others(s)]
+        if confirm_now and unconfirmed:
+            await publish_events(unconfirmed, "stop")
+        elif unconfirmed:
+            self._unconfirmed = unconfirmed
+            self._wakeup.set()
+
+    # ---------------------------------------------------------
+    # KV
+    # ---------------------------------------------------------
+
+    def _key(self, subject: str, gateway_id: str | None = None) -> str:
+        return f"s.{subject}.{gateway_id or self.gateway_id}"
+
+    async def _write(self, acquire, release):
+        ops = [self._kv.put(self._key(s), b"1") for s in acquire]
+        ops += [self._kv.delete(self._key(s)) for s in release]
+        if not ops:
+            return
+        results = await asyncio.gather(*ops, return_exceptions=True)
+        failed = [r for r in results if isinstance(r, Exception)]
+        if failed:
+            logger.error(
+                "[cluster] %s/%s interest update(s) failed: %s",
+                len(failed),
+                len(ops),
+                failed[0],
+            )
+
+    async def _delete(self, key: str):
+        try:
+            await self._kv.delete(key)
+        except Exception as e:
+            logger.warning("[cluster] cannot delete %s: %s", key, e)
+
+    async def _beat(self):
+        try:
+            await self._kv.put(f"g.{self.gateway_id}", str(time.time()).encode())
+        except Exception as e:
+            logger.warning("[cluster] lease refresh failed: %s", e)
+
+    async def _watch(self):
+        while True:
+            entry = await self._watcher.updates(timeout=None)
+            if entry is None:
+                continue  # end of initial values
+
+            deleted = entry.operation in ("DEL", "PURGE")
+            kind, _, rest = entry.key.partition(".")
+
+            if kind == "g":
+                if deleted:
+                    self._leases.pop(rest, None)
+                else:
+                    self._leases[rest] = time.monotonic()
+                continue
+
+            subject, _, gateway_id = rest.rpartition(".")
+            if kind != "s" or not subject:
+                continue
+
+            if deleted:
+                holders = self._holders.get(subject)
+                if holders is not None:
+                    holders.discard(gateway_id)
+                    if not holders:
+                        del self._holders[subject]
+            else:
+                self._holders.setdefault(subject, set()).add(gateway_id)
+
+    async def _reap_dead(self):
+        """
+        Drop gateways whose lease expired; the lowest live gateway
+        publishes `stop` for subjects only they held and purges them.
+        """
+        known = set(self._leases).union(*self._holders.values())
+        dead = {
+            gw for gw in known if gw != self.gateway_id and not self._alive(gw)
+        }
+        if not dead:
+            return
+
+        live = [gw for gw in self._leases if self._alive(gw)] + [self.gateway_id]
+        leader = min(live) == self.gateway_id
+
+        orphaned = []
+        keys = []
+        for subject, holders in list(self._holders.items()):
+            gone = holders & dead
+            if not gone:
+                continue
+            keys.extend(self._key(subject, gw) for gw in gone)
+            holders -= gone
+            if not holders:
+                del self._holders[subject]
+                orphaned.append(subject)
+
+        logger.warning(
+            "[cluster] gateway(s) %s expired, %s subject(s) orphaned",
+            sorted(dead),
+            len(orphaned),
+        )
+        if not leader:
+            return
+
+        if orphaned:
+            await publish_events(orphaned, "stop")
+        keys.extend(f"g.{gw}" for gw in dead if gw in self._leases)
+        await asyncio.gather(*(self._delete(k) for k in keys))
+
+
+# -------------------------------------------------------------------
+# Module API (used by app.nats.interest)
+# -------------------------------------------------------------------
+
+def set_cluster(cluster: ClusterInterest | None):
+    global _cluster
+    _cluster = cluster
+
+
+def get_cluster() -> ClusterInterest | None:
+    return _cluster
+
+
+async def start_cluster(nc) -> ClusterInterest | None:
+    """
+    Join the interest bucket when CLUSTER_INTEREST is on. Falls back to
+    local control events (None) when JetStream KV is unavailable.
+    """
+    if not settings.CLUSTER_INTEREST:
+        return None
+
+    cluster = ClusterInterest(
+        nc.jetstream(),
+        settings.CLUSTER_GATEWAY_ID or default_gateway_id(),
+        lease=settings.CLUSTER_LEASE,
+        debounce=settings.CLUSTER_DEBOUNCE,
+    )
+    try:
+        await cluster.start()
+    except Exception as e:
+        logger.error("[cluster] cannot join interest bucket, local only: %s", e)
+        return None
+
+    set_cluster(cluster)
+    return cluster
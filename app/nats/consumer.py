@@ -1,24 +1,29 @@
 # app/nats/consumer_inverter.py
-import json
+import logging
+from app.core import jsonlib
 from app.ws.send import send_to_subscribers
-from app.core.logging import logger
+from app.core.logging import log_sampled
+from app.nats.pull_consumer import PullConsumer
 
 
-async def consumer(sub):
-    while True:
-        try:
-            msgs = await sub.fetch(10, timeout=1)
-        except:
-            continue
+async def handle_inverter(msg) -> bool:
+    """
+    Forward one inverter message. Returns True when it can be acked.
+    """
+    data = jsonlib.loads(msg.data)
+    subject = data.get("subject")
+    log_sampled(
+        logging.DEBUG,
+        subject,
+        "[Inverter] payload: %s, subject: %s",
+        data,
+        subject,
+    )
 
-        for msg in msgs:
-            try:
-                data = json.loads(msg.data.decode())
-                subject = data.get("subject")
-                logger.info(f"[Inverter] payload: {data}, subject: {subject}")
+    # same envelope as forwarded NATS messages (seq never touches data)
+    await send_to_subscribers(subject, {"subject": subject, "data": data})
+    return True
 
-                await send_to_subscribers(subject, data)
 
-                await msg.ack()
-            except Exception as e:
-                logger.error(f"Inverter consumer error: {e}")
+async def consumer(sub):
+    await PullConsumer(sub, handle_inverter, name="inverter").run()
@@ -1,65 +1,122 @@
 # app/nats/consumer_heartbeat.py
-import json
+import logging
 import time
-from app.core.logging import logger
+from app.core import jsonlib
+from app.core.config import settings
+from app.core.logging import logger, log_sampled
 from app.ws.send import send_to_subscribers
+from app.nats.pull_consumer import PullConsumer
+from app.nats.status_store import device_status
+from app.watchdog.offline_checker import OfflineWatchdog
+
+offline_watchdog = OfflineWatchdog(device_status)
+
+# uuid -> (forwarded payload fields, forwarded_at)
+_forwarded: dict[str, tuple[dict | None, float]] = {}
+
+_VOLATILE_FIELDS = frozenset(settings.HEARTBEAT_VOLATILE_FIELDS)
+
+
+def _should_forward(
+    uuid: str,
+    status: str,
+    previous_status: str | None,
+    payload: dict,
+    now: float,
+) -> bool:
+    """
+    Change-only forwarding: True for status transitions (and payload
+    changes in "changes" mode) or when the keep-alive is due.
+    """
+    mode = settings.HEARTBEAT_FORWARD
+    if mode == "all":
+        return True
+
+    state = _forwarded.get(uuid)
+    fields = None
+    changed = state is None or status != previous_status
+
+    if mode == "changes":
+        fields = {k: v for k, v in payload.items() if k not in _VOLATILE_FIELDS}
+        changed = changed or fields != state[0]
+
+    keepalive = settings.HEARTBEAT_KEEPALIVE
+    if not changed and not (keepalive > 0 and now - state[1] >= keepalive):
+        return False
+
+    _forwarded[uuid] = (fields, now)
+    return True
+
+
+async def handle_heartbeat(msg) -> bool:
+    """
+    Process one heartbeat. Always acked (bad payloads are not retried).
+    """
+    try:
+        data = jsonlib.loads(msg.data)
+
+        if not isinstance(data, dict):
+            logger.error(
+                "Heartbeat consumer error: unexpected payload type "
+                "(subject=%s, payload=%s)",
+                msg.subject,
+                data,
+            )
+            return True
+
+        payload = data.get("payload", {})
+        if not isinstance(payload, dict):
+            logger.error(
+                "Heartbeat consumer error: payload is not a dict "
+                "(subject=%s, payload=%s)",
+                msg.subject,
+                data,
+            )
+            return True
+
+        uuid = payload.get("uuid")
+        status = payload.get("status", "online")
+
+        if not uuid or not isinstance(uuid, str):
+            logger.error(
+                "Heartbeat consumer error: missing or invalid uuid "
+                "(subject=%s, payload=%s)",
+                msg.subject,
+                data,
+            )
+            return True
+
+        if not status or not isinstance(status, str):
+            logger.error(
+                "Heartbeat consumer error: invalid status "
+                "(subject=%s, payload=%s)",
+                msg.subject,
+                data,
+            )
+            return True
+
+        now = time.time()
+        previous_status = device_status.update(uuid, status, now)
+
+        # optional per-device override (slow heartbeat intervals)
+        offline_timeout = payload.get("offline_timeout")
+        if isinstance(offline_timeout, (int, float)) and offline_timeout > 0:
+            offline_watchdog.set_timeout(uuid, float(offline_timeout))
+        offline_watchdog.touch(uuid, now)
+
+        log_sampled(logging.DEBUG, uuid, "Heartbeat %s, payload: %s", uuid, data)
+
+        if _should_forward(uuid, status, previous_status, payload, now):
+            await send_to_subscribers(uuid, {
+                "type": "raspberry_heartbeat",
+                "data": {**payload, "status": status}
+            })
+
+        return True
+    except Exception as e:
+        logger.error("Heartbeat consumer error: %s (subject=%s)", e, msg.subject)
+        return True
 
-last_seen = {}
-raspberry_status = {}
 
 async def heartbeat_consumer(sub):
-    while True:
-        try:
-            msgs = await sub.fetch(10, timeout=1)
-        except:
-            continue
-
-        for msg in msgs:
-            try:
-                data = json.loads(msg.data.decode())
-                logger.info(f"Heartbeat message data: {data}")
-
-                if not isinstance(data, dict):
-                    logger.error(
-                        f"Heartbeat consumer error: unexpected payload type "
-                        f"(subject={msg.subject}, payload={data})"
-                    )
-                    await msg.ack()
-                    continue
-
-                payload = data.get("payload", {})
-                if not isinstance(payload, dict):
-                    logger.error(
-                        f"Heartbeat consumer error: payload is not a dict "
-                        f"(subject={msg.subject}, payload={data})"
-                    )
-                    await msg.ack()
-                    continue
-
-                uuid = payload.get("uuid")
-                status = payload.get("status", "online")
-
-                if not uuid:
-                    logger.error(
-                        f"Heartbeat consumer error: missing uuid "
-                        f"(subject={msg.subject}, payload={data})"
-                    )
-                    await msg.ack()
-                    continue
-
-                logger.info(f"Received heartbeat message: {data}")
-
-                last_seen[uuid] = time.time()
-                raspberry_status[uuid] = status
-
-                logger.info(f"Heartbeat {uuid}, payload: {data}")
-
-                await send_to_subscribers(uuid, {
-                    "type": "raspberry_heartbeat",
-                    "data": {**payload, "status": status}
-                })
-
-                await msg.ack()
-            except Exception as e:
-                logger.error(f"Heartbeat consumer error: {e} (subject={msg.subject})")
-                await msg.ack()
+    await PullConsumer(sub, handle_heartbeat, name="heartbeat").run()
@@ -0,0 +1,119 @@
+# app/nats/interest.py
+"""
+Who announces control `start` / `stop` events for a subject.
+
+Single process: the gateway publishes them itself when the first WS
+subscriber arrives / the last one leaves.
+
+Worker mode (WORKERS > 1): every worker only knows its own clients, so
+workers report local interest changes to the supervisor, which keeps a
+per-worker refcount and publishes `start` / `stop` only on GLOBAL
+first / last interest.
+
+Cluster mode (CLUSTER_INTEREST): the publishing process (gateway or
+supervisor) coordinates with the other gateways first, see
+app.nats.cluster.
+"""
+from app.core.logging import logger
+from app.nats.cluster import get_cluster
+from app.nats.publisher import publish_events
+
+# supervisor pipe (worker mode) or None (publish locally)
+_conn = None
+
+
+def set_interest_pipe(conn):
+    """
+    Report interest changes to the supervisor instead of publishing.
+    """
+    global _conn
+    _conn = conn
+    logger.info("Control events delegated to supervisor")
+
+
+async def publish_interest(action: str, subjects):
+    """
+    This process' interest in subjects changed: publish the control
+    events, or hand them to the cluster coordinator.
+    """
+    cluster = get_cluster()
+    if cluster is not None:
+        subjects = cluster.update(action, subjects)
+        if not subjects:
+            return
+    await publish_events(subjects, action)
+
+
+async def _announce(action: str, subjects):
+    if _conn is None:
+        await publish_interest(action, subjects)
+        return
+
+    try:
+        _conn.send((action, list(subjects)))
+    except (OSError, ValueError) as e:
+        logger.error(
+            "Cannot report '%s' for %s subject(s) to supervisor: %s",
+            action,
+            len(subjects),
+            e,
+        )
+
+
+async def announce_start(subjects):
+    """
+    Local first subscriber(s) for subjects.
+    """
+    await _announce("start", subjects)
+
+
+async def announce_stop(subjects):
+    """
+    No local subscribers left for subjects.
+    """
+    await _announce("stop", subjects)
+
+
+# -------------------------------------------------------------------
+# Supervisor side
+# -------------------------------------------------------------------
+
+class InterestTable:
+    """
+    subject -> set(worker ids) with interest. Methods return the subjects
+    whose GLOBAL interest changed (and need a control event).
+    """
+
+    def __init__(self):
+        self._workers: dict[str, set[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._workers)
+
+    def acquire(self, worker: int, subjects) -> list[str]:
+        started = []
+        for subject in subjects:
+            workers = self._workers.setdefault(subject, set())
+            if not workers:
+                started.append(subject)
+            workers.add(worker)
+        return started
+
+    def release(self, worker: int, subjects) -> list[str]:
+        stopped = []
+        for subject in subjects:
+            workers = self._workers.get(subject)
+            if not workers or worker not in workers:
+                continue
+            workers.discard(worker)
+            if not workers:
+                del self._workers[subject]
+                stopped.append(subject)
+        return stopped
+
+    def drop_worker(self, worker: int) -> list[str]:
+        """
+        Worker exited: release everything it held.
+        """
+        held = [s for s, workers in self._workers.items() if worker in workers]
+        return self.release(worker, held)
@@ -0,0 +1,145 @@
+# app/nats/linger.py
+"""
+Grace period (WS_LINGER_SECONDS) before a subject's last WS subscriber
+leaving turns into a NATS unsubscribe + control `stop` event.
+
+A resubscribe within the period (page reload, flaky mobile link) cancels
+the pending stop: the NATS subscription was never dropped and no `start`
+is announced again. All pending stops share one scheduler task driven by
+a deadline heap (same pattern as the offline watchdog).
+"""
+import asyncio
+import time
+
+from app.core.logging import logger
+from app.nats.interest import announce_stop
+from app.watchdog.deadlines import DeadlineQueue
+
+# active scheduler (None -> stop immediately)
+_scheduler: "LingerScheduler | None" = None
+
+
+class LingerScheduler:
+    def __init__(self, nats_manager, seconds: float):
+        self._nats_manager = nats_manager
+        self._seconds = seconds
+        self._deadlines = DeadlineQueue()
+
+        self._wakeup = asyncio.Event()
+        self._sleep_until: float | None = None
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    # ---------------------------------------------------------
+    # Scheduling
+    # ---------------------------------------------------------
+
+    def defer(self, subjects):
+        """
+        Last local subscriber of subjects left: stop them after the
+        grace period.
+        """
+        deadline = time.monotonic() + self._seconds
+        for subject in subjects:
+            self._deadlines.set(subject, deadline)
+
+        if self._sleep_until is None:
+            self._wakeup.set()
+
+    def resume(self, subjects) -> list[str]:
+        """
+        First subscriber(s) again: cancel pending stops.
+
+        Returns:
+            subjects that were not lingering (need a real start)
+        """
+        fresh = []
+        for subject in subjects:
+            if subject in self._deadlines:
+                self._deadlines.discard(subject)
+            else:
+                fresh.append(subject)
+
+        resumed = len(subjects) - len(fresh)
+        if resumed:
+            logger.debug(
+                "[linger] %s subject(s) resumed within grace period", resumed
+            )
+        return fresh
+
+    # ---------------------------------------------------------
+    # Loop
+    # ---------------------------------------------------------
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            deadline = self._deadlines.next_deadline()
+
+            if deadline is None:
+                self._sleep_until = None
+                await self._wakeup.wait()
+                continue
+
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                # deadlines only move later (fixed period) -> no early wakeup
+                self._sleep_until = deadline
+                await asyncio.sleep(delay)
+                continue
+
+            self._sleep_until = None
+            expired = self._deadlines.pop_expired(time.monotonic())
+            if expired:
+                await self._stop(expired)
+
+    async def flush(self):
+        """
+        Stop every lingering subject now (shutdown).
+        """
+        pending = self._deadlines.pop_expired(float("inf"))
+        if pending:
+            await self._stop(pending)
+
+    async def _stop(self, subjects: list[str]):
+        try:
+            await self._nats_manager.stop_many(subjects)
+            await announce_stop(subjects)
+        except Exception as e:
+            logger.exception(
+                "[linger] stopping %s subject(s) failed: %s", len(subjects), e
+            )
+            return
+        logger.info(
+            "[linger] %s subject(s) stopped after grace period", len(subjects)
+        )
+
+
+def set_linger(scheduler: LingerScheduler | None):
+    global _scheduler
+    _scheduler = scheduler
+
+
+def resume(subjects) -> list[str]:
+    """
+    Subjects (of a first-subscriber batch) that need a real start.
+    """
+    if _scheduler is None:
+        return list(subjects)
+    return _scheduler.resume(subjects)
+
+
+def defer(subjects) -> bool:
+    """
+    Hand emptied subjects to the scheduler. Returns False when lingering
+    is disabled (caller stops them immediately).
+    """
+    if _scheduler is None:
+        return False
+    _scheduler.defer(subjects)
+    return True
+
+
+def lingering() -> int:
+    return len(_scheduler) if _scheduler is not None else 0
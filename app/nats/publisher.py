@@ -1,6 +1,7 @@
 # app/nats/publisher.py
-import json
+from app.core import jsonlib
 from app.core.logging import logger
+from app.nats.subjects import is_wildcard
 
 _nats_client = None
 
@@ -14,14 +15,25 @@ def set_nats_client(nc):
     logger.info("NATS client attached to publisher")
 
 
+def get_nats_client():
+    return _nats_client
+
+
 async def publish_event(subject: str, action: str, data: dict | None = None):
     if not _nats_client:
         logger.error(
-            f"Cannot publish event '{action}' for {subject}: "
-            f"NATS client is not set"
+            "Cannot publish event '%s' for %s: "
+            "NATS client is not set",
+            action,
+            subject,
         )
         return
 
+    if is_wildcard(subject):
+        # control events target concrete devices only
+        logger.debug("Skipping control event '%s' for pattern %s", action, subject)
+        return
+
     payload = {
         "subject": subject,
         "action": action,
@@ -31,12 +43,76 @@ async def publish_event(subject: str, action: str, data: dict | None = None):
     try:
         await _nats_client.publish(
             f"control.{subject}",
-            json.dumps(payload).encode(),
+            jsonlib.dumpb(payload),
         )
         logger.info(
-            f"Published control event '{action}' for {subject}"
+            "Published control event '%s' for %s",
+            action,
+            subject,
         )
     except Exception as e:
         logger.exception(
-            f"Failed to publish control event '{action}' for {subject}: {e}"
+            "Failed to publish control event '%s' for %s: %s",
+            action,
+            subject,
+            e,
         )
+
+
+async def publish_events(
+    subjects,
+    action: str,
+    data: dict | None = None,
+    flush_timeout: float = 2.0,
+):
+    """
+    Pipeline control events for many subjects (one `control.<subject>`
+    message each, as devices expect) and flush them with a single
+    round trip instead of one per subject.
+    """
+    subjects = [s for s in subjects if not is_wildcard(s)]
+    if not subjects:
+        return
+
+    if not _nats_client:
+        logger.error(
+            "Cannot publish %s '%s' event(s): "
+            "NATS client is not set",
+            len(subjects),
+            action,
+        )
+        return
+
+    published = 0
+    for subject in subjects:
+        payload = {
+            "subject": subject,
+            "action": action,
+            "data": data or {},
+        }
+        try:
+            await _nats_client.publish(
+                f"control.{subject}",
+                jsonlib.dumpb(payload),
+            )
+            published += 1
+        except Exception as e:
+            logger.exception(
+                "Failed to publish control event '%s' for %s: %s",
+                action,
+                subject,
+                e,
+            )
+
+    try:
+        await _nats_client.flush(timeout=flush_timeout)
+    except Exception as e:
+        logger.warning("Flush of control events '%s' failed: %s", action, e)
+
+    logger.info(
+        "Published control event '%s' for "
+        "%s/%s subject(s)",
+        action,
+        published,
+        len(subjects),
+    )
@@ -0,0 +1,150 @@
+# app/nats/pull_consumer.py
+import asyncio
+
+from nats.errors import TimeoutError as NatsTimeoutError
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.ws.client import total_backlog
+
+
+class PullConsumer:
+    """
+    JetStream pull-consumer engine.
+
+    - adaptive batch size: grows while fetches come back full, shrinks
+      on partial batches / fetch timeouts (PULL_MIN_BATCH..PULL_MAX_BATCH)
+    - bounded pool of concurrent handlers (PULL_CONCURRENCY)
+    - acks are collected and published together, not awaited per message
+    - stops fetching while WS fan-out is backlogged (PULL_BACKPRESSURE_*)
+
+    handler(msg) returns True when the message should be acked; a handler
+    returning False or raising leaves it for JetStream redelivery.
+    """
+
+    def __init__(self, sub, handler, *, name: str):
+        self._sub = sub
+        self._handler = handler
+        self._name = name
+
+        self._min_batch = settings.PULL_MIN_BATCH
+        self._max_batch = settings.PULL_MAX_BATCH
+        self._batch = self._min_batch
+
+        self._slots = asyncio.Semaphore(settings.PULL_CONCURRENCY)
+        self._tasks: set[asyncio.Task] = set()
+        self._acks: list = []
+
+        self._paused = False
+
+        # counters
+        self.processed = 0
+        self.failed = 0
+
+    # ---------------------------------------------------------
+    # Loop
+    # ---------------------------------------------------------
+
+    async def run(self):
+        logger.info("[%s] pull consumer started", self._name)
+        try:
+            while True:
+                await self._flush_acks()
+
+                if self._backpressured():
+                    await asyncio.sleep(settings.PULL_BACKPRESSURE_PAUSE)
+                    continue
+
+                try:
+                    msgs = await self._sub.fetch(
+                        self._batch, timeout=settings.PULL_FETCH_TIMEOUT
+                    )
+                except NatsTimeoutError:
+                    self._batch = max(self._min_batch, self._batch // 2)
+                    continue
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error("[%s] fetch failed: %s", self._name, e)
+                    await asyncio.sleep(settings.PULL_ERROR_BACKOFF)
+                    continue
+
+                if len(msgs) >= self._batch:
+                    self._batch = min(self._max_batch, self._batch * 2)
+                else:
+                    self._batch = max(self._min_batch, self._batch // 2)
+
+                for msg in msgs:
+                    await self._slots.acquire()
+                    task = asyncio.create_task(self._handle(msg))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+        finally:
+            await self._drain()
+
+    async def _drain(self):
+        """
+        Shutdown: let running handlers finish (bounded), then publish the
+        acks they queued so JetStream does not redeliver processed messages.
+        """
+        timeout = settings.PULL_DRAIN_TIMEOUT
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=timeout)
+        for task in list(self._tasks):
+            task.cancel()
+
+        try:
+            await asyncio.wait_for(self._flush_acks(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("[%s] pending acks not flushed on shutdown", self._name)
+        logger.info("[%s] pull consumer stopped", self._name)
+
+    def _backpressured(self) -> bool:
+        backlog = total_backlog()
+
+        if self._paused:
+            if backlog <= settings.PULL_BACKPRESSURE_LOW:
+                self._paused = False
+                logger.info(
+                    "[%s] WS backlog %s, resuming fetch",
+                    self._name,
+                    backlog,
+                )
+        elif backlog >= settings.PULL_BACKPRESSURE_HIGH:
+            self._paused = True
+            logger.warning(
+                "[%s] WS backlog %s, pausing fetch",
+                self._name,
+                backlog,
+            )
+        return self._paused
+
+    # ---------------------------------------------------------
+    # Handlers / acks
+    # ---------------------------------------------------------
+
+    async def _handle(self, msg):
+        try:
+            if await self._handler(msg):
+                self._acks.append(msg)
+                if len(self._acks) >= settings.PULL_ACK_BATCH:
+                    await self._flush_acks()
+            self.processed += 1
+        except Exception as e:
+            self.failed += 1
+            logger.error("[%s] handler error: %s", self._name, e)
+        finally:
+            self._slots.release()
+
+    async def _flush_acks(self):
+        if not self._acks:
+            return
+
+        acks, self._acks = self._acks, []
+        results = await asyncio.gather(
+            *(msg.ack() for msg in acks),
+            return_exceptions=True,
+        )
+        failed = sum(1 for r in results if isinstance(r, Exception))
+        if failed:
+            logger.warning("[%s] %s/%s ack(s) failed", self._name, failed, len(acks))
@@ -0,0 +1,249 @@
+# app/nats/status_store.py
+"""
+Device status store (heartbeat state).
+
+Column layout instead of two dicts of per-device objects:
+
+    uuid -> row index (one dict)
+    last seen  -> array('d')   (8 bytes / device)
+    status     -> array('H')   (index into the interned status names)
+
+so 100k devices cost a dict of uuids plus ~1 MB of arrays, and the
+whole store snapshots to disk as a JSON header (uuid list included)
+followed by the raw array bytes. A snapshot is loaded at startup
+(array.frombytes, no per-device parsing beyond the uuid list), so
+statuses are known before the first heartbeat arrives.
+
+Status names are interned: at most MAX_STATUS_NAMES distinct values of
+up to MAX_STATUS_LENGTH characters; anything else is stored as
+OTHER_STATUS.
+"""
+import asyncio
+import os
+import sys
+import time
+from array import array
+
+from app.core import jsonlib
+from app.core.config import settings
+from app.core.logging import logger
+
+OFFLINE = "offline"
+OTHER_STATUS = "unknown"
+
+MAX_STATUS_NAMES = 1024
+MAX_STATUS_LENGTH = 64
+
+_MAGIC = b"GWSTATUS2\n"
+
+
+class StatusStore:
+    def __init__(self):
+        self._rows: dict[str, int] = {}
+        self._uuids: list[str] = []
+        self._seen = array("d")
+        self._status = array("H")
+
+        # interned status values
+        self._names: list[str] = []
+        self._codes: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._uuids)
+
+    def __contains__(self, uuid) -> bool:
+        return uuid in self._rows
+
+    def _code(self, status: str) -> int:
+        code = self._codes.get(status)
+        if code is None:
+            if (
+                len(self._names) >= MAX_STATUS_NAMES
+                or len(status) > MAX_STATUS_LENGTH
+            ) and status != OTHER_STATUS:
+                return self._code(OTHER_STATUS)
+            code = self._codes[status] = len(self._names)
+            self._names.append(status)
+        return code
+
+    # ---------------------------------------------------------
+    # Updates
+    # ---------------------------------------------------------
+
+    def update(self, uuid: str, status: str, ts: float) -> str | None:
+        """
+        Heartbeat from uuid. Returns its previous status (None if new).
+        """
+        code = self._code(status)
+        row = self._rows.get(uuid)
+        if row is None:
+            self._rows[uuid] = len(self._uuids)
+            self._uuids.append(uuid)
+            self._seen.append(ts)
+            self._status.append(code)
+            return None
+
+        previous = self._names[self._status[row]]
+        self._seen[row] = ts
+        self._status[row] = code
+        return previous
+
+    def set_status(self, uuid: str, status: str):
+        row = self._rows.get(uuid)
+        if row is not None:
+            self._status[row] = self._code(status)
+
+    # ---------------------------------------------------------
+    # Queries
+    # ---------------------------------------------------------
+
+    def status(self, uuid: str) -> str | None:
+        row = self._rows.get(uuid)
+        return None if row is None else self._names[self._status[row]]
+
+    def last_seen(self, uuid: str) -> float | None:
+        row = self._rows.get(uuid)
+        return None if row is None else self._seen[row]
+
+    def get_many(self, uuids) -> dict:
+        """
+        uuid -> {"status", "last_seen"} (None for unknown devices).
+        """
+        rows = self._rows
+        names = self._names
+        seen = self._seen
+        status = self._status
+
+        result = {}
+        for uuid in uuids:
+            row = rows.get(uuid)
+            result[uuid] = (
+                None
+                if row is None
+                else {"status": names[status[row]], "last_seen": seen[row]}
+            )
+        return result
+
+    def online(self):
+        """
+        (uuid, last_seen) of every device not marked offline.
+        """
+        offline = self._codes.get(OFFLINE)
+        for row, uuid in enumerate(self._uuids):
+            if self._status[row] != offline:
+                yield uuid, self._seen[row]
+
+    # ---------------------------------------------------------
+    # Snapshot
+    # ---------------------------------------------------------
+
+    def dump(self) -> bytes:
+        header = {
+            "names": self._names,
+            "count": len(self._uuids),
+            "uuids": self._uuids,
+            "byteorder": sys.byteorder,
+            "saved_at": time.time(),
+        }
+        return b"".join((
+            _MAGIC,
+            jsonlib.dumpb(header),
+            b"\n",
+            self._seen.tobytes(),
+            self._status.tobytes(),
+        ))
+
+    def load(self, blob: bytes):
+        """
+        Replace the store with a dump(). Raises ValueError if malformed.
+        """
+        if not blob.startswith(_MAGIC):
+            raise ValueError("not a status snapshot")
+
+        start = len(_MAGIC)
+        end = blob.index(b"\n", start)
+        header = jsonlib.loads(blob[start:end])
+        count = header["count"]
+        uuids = header["uuids"]
+        names = header["names"]
+        if not all(isinstance(u, str) for u in uuids) or len(set(uuids)) != count:
+            raise ValueError("invalid uuids in status snapshot")
+
+        seen = array("d")
+        status = array("H")
+        seen_start = end + 1
+        seen_end = seen_start + count * seen.itemsize
+        seen.frombytes(blob[seen_start:seen_end])
+        status.frombytes(blob[seen_end:seen_end + count * status.itemsize])
+        if len(uuids) != count or len(seen) != count or len(status) != count:
+            raise ValueError("truncated status snapshot")
+
+        if header["byteorder"] != sys.byteorder:
+            seen.byteswap()
+            status.byteswap()
+        if count and max(status) >= len(names):
+            raise ValueError("unknown status code in status snapshot")
+
+        self._uuids = uuids
+        self._rows = {uuid: row for row, uuid in enumerate(uuids)}
+        self._seen = seen
+        self._status = status
+        self._names = list(names)
+        self._codes = {name: code for code, name in enumerate(self._names)}
+
+
+def _write(path: str, blob: bytes):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(blob)
+    os.replace(tmp, path)
+
+
+def load_snapshot(store: StatusStore, path: str | None = None) -> bool:
+    """
+    Warm start from the last snapshot (if any).
+    """
+    path = path or settings.STATUS_SNAPSHOT_PATH
+    if not path or not os.path.exists(path):
+        return False
+
+    try:
+        with open(path, "rb") as f:
+            store.load(f.read())
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning("Cannot load status snapshot %s: %s", path, e)
+        return False
+
+    logger.info("Loaded %s device status(es) from %s", len(store), path)
+    return True
+
+
+async def save_snapshot(store: StatusStore, path: str | None = None):
+    path = path or settings.STATUS_SNAPSHOT_PATH
+    if not path:
+        return
+    try:
+        # serialize on the loop (consistent view), write in a thread
+        blob = store.dump()
+        await asyncio.to_thread(_write, path, blob)
+    except Exception as e:
+        logger.exception("Cannot write status snapshot %s: %s", path, e)
+
+
+async def snapshot_loop(store: StatusStore):
+    """
+    Periodic snapshot (STATUS_SNAPSHOT_INTERVAL); a final one is written
+    on cancellation (shutdown).
+    """
+    try:
+        while True:
+            await asyncio.sleep(settings.STATUS_SNAPSHOT_INTERVAL)
+            await save_snapshot(store)
+    finally:
+        await save_snapshot(store)
+
+
+device_status = StatusStore()
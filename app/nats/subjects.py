@@ -0,0 +1,166 @@
+# app/nats/subjects.py
+"""
+NATS subject helpers: wildcard validation/matching and a token trie
+for routing concrete subjects to wildcard patterns (`*` and `>`).
+"""
+
+WILDCARD_ONE = "*"
+WILDCARD_TAIL = ">"
+
+
+def is_wildcard(subject: str) -> bool:
+    return any(t == WILDCARD_ONE or t == WILDCARD_TAIL for t in subject.split("."))
+
+
+def is_valid_subject(subject: str) -> bool:
+    """
+    Valid NATS subject or pattern: non-empty tokens, no whitespace,
+    `>` only as the last token.
+    """
+    if not subject or not isinstance(subject, str):
+        return False
+
+    tokens = subject.split(".")
+    for i, token in enumerate(tokens):
+        if not token or any(c.isspace() for c in token):
+            return False
+        if token == WILDCARD_TAIL and i != len(tokens) - 1:
+            return False
+    return True
+
+
+def subject_matches(pattern: str, subject: str) -> bool:
+    """
+    True if concrete subject matches pattern.
+    """
+    p_tokens = pattern.split(".")
+    s_tokens = subject.split(".")
+
+    for i, p in enumerate(p_tokens):
+        if p == WILDCARD_TAIL:
+            return len(s_tokens) > i
+        if i >= len(s_tokens):
+            return False
+        if p != WILDCARD_ONE and p != s_tokens[i]:
+            return False
+    return len(p_tokens) == len(s_tokens)
+
+
+def pattern_covers(broad: str, narrow: str) -> bool:
+    """
+    True if every subject matched by `narrow` is also matched by `broad`.
+    """
+    b_tokens = broad.split(".")
+    n_tokens = narrow.split(".")
+
+    for i, b in enumerate(b_tokens):
+        if b == WILDCARD_TAIL:
+            return len(n_tokens) > i
+        if i >= len(n_tokens):
+            return False
+        n = n_tokens[i]
+        if n == WILDCARD_TAIL:
+            return False
+        if b == WILDCARD_ONE:
+            continue
+        if n == WILDCARD_ONE or b != n:
+            return False
+    return len(b_tokens) == len(n_tokens)
+
+
+# -------------------------------------------------------------------
+# Subject trie
+# -------------------------------------------------------------------
+
+class _Node:
+    __slots__ = ("children", "pattern")
+
+    def __init__(self):
+        self.children: dict[str, "_Node"] = {}
+        self.pattern: str | None = None
+
+
+class SubjectTrie:
+    """
+    Token trie of subject patterns.
+
+    match(subject) returns every stored pattern matching the concrete
+    subject in O(tokens * wildcard branches), independent of how many
+    patterns are stored.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, pattern: str) -> bool:
+        """
+        Returns True if pattern was not stored yet.
+        """
+        node = self._root
+        for token in pattern.split("."):
+            node = node.children.setdefault(token, _Node())
+
+        if node.pattern is not None:
+            return False
+        node.pattern = pattern
+        self._size += 1
+        return True
+
+    def remove(self, pattern: str) -> bool:
+        """
+        Returns True if pattern was stored (and is now removed).
+        """
+        path = []
+        node = self._root
+        for token in pattern.split("."):
+            child = node.children.get(token)
+            if child is None:
+                return False
+            path.append((node, token))
+            node = child
+
+        if node.pattern is None:
+            return False
+        node.pattern = None
+        self._size -= 1
+
+        # prune empty branches
+        for parent, token in reversed(path):
+            child = parent.children[token]
+            if child.pattern is not None or child.children:
+                break
+            del parent.children[token]
+        return True
+
+    def match(self, subject: str) -> list[str]:
+        """
+        Returns stored patterns matching concrete subject.
+        """
+        result: list[str] = []
+        tokens = subject.split(".")
+        self._match(self._root, tokens, 0, result)
+        return result
+
+    def _match(self, node: _Node, tokens: list[str], i: int, result: list[str]):
+        children = node.children
+
+        if i == len(tokens):
+            if node.pattern is not None:
+                result.append(node.pattern)
+            return
+
+        tail = children.get(WILDCARD_TAIL)
+        if tail is not None and tail.pattern is not None:
+            result.append(tail.pattern)
+
+        one = children.get(WILDCARD_ONE)
+        if one is not None:
+            self._match(one, tokens, i + 1, result)
+
+        literal = children.get(tokens[i])
+        if literal is not None:
+            self._match(literal, tokens, i + 1, result)
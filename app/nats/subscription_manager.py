@@ -1,27 +1,221 @@
 import asyncio
+from app.core.config import settings
 from app.core.logging import logger
+from app.nats.subjects import SubjectTrie, is_wildcard, pattern_covers
+
+
+def _breadth(subject: str):
+    # broadest patterns first: tail wildcards, then fewer tokens, then
+    # more `*` (dev.* before dev.1 so the literal is seen as covered)
+    return (
+        not subject.endswith(">"),
+        subject.count("."),
+        -subject.count("*"),
+    )
+
 
 class NatsSubscriptionManager:
-    def __init__(self, nc, on_message_cb):
+    """
+    Keeps the set of NATS subscriptions minimal.
+
+    Subjects (or wildcard patterns) already covered by an active NATS
+    subscription - e.g. a broad `device_communication.>` - do not open a
+    new one; the in-process registry routes them instead. When active
+    subscriptions overlap, every message is dispatched only by its
+    OWNER subscription so WS clients never see duplicates.
+    """
+
+    def __init__(self, nc, on_message_cb, broad_subjects=()):
         self._nc = nc
         self._on_message_cb = on_message_cb
         self._subs = {}
         self._lock = asyncio.Lock()
 
+        # subjects requested via start() (refcounting is done by WS registry)
+        self._wanted: set[str] = set()
+        # broad subscriptions held for the gateway lifetime
+        self._pinned: set[str] = set(broad_subjects)
+
+        # active (non-detached) NATS patterns, for ownership / coverage
+        self._live: set[str] = set()
+        self._active = SubjectTrie()
+        self._owner_cache: dict[str, str | None] = {}
+
+    # ---------------------------------------------------------
+    # Public API
+    # ---------------------------------------------------------
+
+    @property
+    def subscription_count(self) -> int:
+        return len(self._subs)
+
+    async def start_broad(self):
+        async with self._lock:
+            await self._subscribe_many(
+                [s for s in self._pinned if s not in self._subs]
+            )
+
     async def start(self, subject: str):
+        await self.start_many([subject])
+
+    async def stop(self, subject: str):
+        await self.stop_many([subject])
+
+    async def start_many(self, subjects):
+        """
+        Ensure NATS delivery for all subjects with one lock acquisition;
+        new NATS subscriptions are issued concurrently.
+        """
         async with self._lock:
-            if subject in self._subs:
+            self._wanted.update(subjects)
+
+            chosen = self._uncovered(subjects)
+            if not chosen:
                 return
 
-            logger.info(f"[nats] subscribe {subject}")
-            sub = await self._nc.subscribe(subject, cb=self._on_message_cb)
-            self._subs[subject] = sub
+            await self._subscribe_many(chosen)
 
-    async def stop(self, subject: str):
+            # narrower subscriptions (older or from this batch) are now
+            # redundant
+            redundant = [
+                active
+                for active in self._subs
+                if active not in self._pinned
+                and any(
+                    c != active and c in self._subs and pattern_covers(c, active)
+                    for c in chosen
+                )
+            ]
+            await self._unsubscribe_many(redundant)
+
+    async def stop_many(self, subjects):
         async with self._lock:
-            sub = self._subs.pop(subject, None)
-            if not sub:
+            self._wanted.difference_update(subjects)
+
+            dropped = [
+                s for s in subjects
+                if s in self._subs and s not in self._pinned
+            ]
+            if not dropped:
+                return
+
+            # subjects only covered by the dropped subscriptions need their
+            # own; the dropped ones stay active (and own their messages)
+            # until the replacements are subscribed, then unsubscribe
+            for subject in dropped:
+                self._detach(subject)
+            replacements = self._uncovered(self._wanted)
+            for subject in dropped:
+                self._attach(subject)
+            self._owner_cache.clear()
+
+            await self._subscribe_many(replacements)
+            await self._unsubscribe_many(dropped)
+
+    # ---------------------------------------------------------
+    # Internals (under lock)
+    # ---------------------------------------------------------
+
+    def _covering(self, subject: str) -> str | None:
+        if not is_wildcard(subject):
+            matches = self._active.match(subject)
+            return min(matches) if matches else None
+
+        for active in self._live:
+            if pattern_covers(active, subject):
+                return active
+        return None
+
+    def _uncovered(self, subjects) -> list[str]:
+        """
+        Minimal list of subjects that need their own NATS subscription.
+        """
+        chosen: list[str] = []
+        chosen_wild: list[str] = []
+
+        for subject in sorted(subjects, key=_breadth):
+            if subject in self._live:
+                continue
+            if self._covering(subject):
+                continue
+            if any(pattern_covers(c, subject) for c in chosen_wild):
+                continue
+
+            chosen.append(subject)
+            if is_wildcard(subject):
+                chosen_wild.append(subject)
+
+        return chosen
+
+    def _attach(self, subject: str):
+        self._live.add(subject)
+        self._active.add(subject)
+
+    def _detach(self, subject: str):
+        if subject in self._live:
+            self._live.discard(subject)
+            self._active.remove(subject)
+
+    async def _subscribe_many(self, subjects):
+        if not subjects:
+            return
+
+        logger.info("[nats] subscribe %s", sorted(subjects))
+        results = await asyncio.gather(
+            *(
+                self._nc.subscribe(subject, cb=self._make_cb(subject))
+                for subject in subjects
+            ),
+            return_exceptions=True,
+        )
+
+        for subject, sub in zip(subjects, results):
+            if isinstance(sub, Exception):
+                logger.error("[nats] subscribe %s failed: %s", subject, sub)
+                continue
+
+            self._subs[subject] = sub
+            self._attach(subject)
+        self._owner_cache.clear()
+
+    async def _unsubscribe_many(self, subjects):
+        if not subjects:
+            return
+
+        subs = []
+        for subject in subjects:
+            subs.append(self._subs.pop(subject))
+            self._detach(subject)
+        self._owner_cache.clear()
+
+        logger.info("[nats] unsubscribe %s", sorted(subjects))
+        results = await asyncio.gather(
+            *(sub.unsubscribe() for sub in subs),
+            return_exceptions=True,
+        )
+        for subject, result in zip(subjects, results):
+            if isinstance(result, Exception):
+                logger.error("[nats] unsubscribe %s failed: %s", subject, result)
+
+    # ---------------------------------------------------------
+    # Dispatch (dedup of overlapping subscriptions)
+    # ---------------------------------------------------------
+
+    def _owner(self, subject: str) -> str | None:
+        owner = self._owner_cache.get(subject)
+        if owner is None:
+            matches = self._active.match(subject)
+            owner = min(matches) if matches else None
+
+            if len(self._owner_cache) >= settings.SUBJECT_MATCH_CACHE_SIZE:
+                del self._owner_cache[next(iter(self._owner_cache))]
+            self._owner_cache[subject] = owner
+        return owner
+
+    def _make_cb(self, pattern: str):
+        async def cb(msg):
+            if len(self._subs) > 1 and self._owner(msg.subject) != pattern:
                 return
+            await self._on_message_cb(msg)
 
-            logger.info(f"[nats] unsubscribe {subject}")
-            await sub.unsubscribe()
+        return cb
@@ -0,0 +1,191 @@
+# app/supervisor.py
+"""
+Multi-process mode (WORKERS > 1).
+
+The supervisor spawns N gateway workers that all bind the WS port with
+SO_REUSEPORT; the kernel load-balances connections between them. Each
+worker has its own NATS connection and subscription registry.
+
+Control `start` / `stop` events are owned by the supervisor: workers
+report local interest over a pipe and the supervisor publishes only on
+global first / last interest (see app.nats.interest; across gateways:
+app.nats.cluster). Crashed workers are restarted and their interest
+released.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+
+import nats
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.core.loop import run
+from app.nats.cluster import start_cluster
+from app.nats.interest import InterestTable, publish_interest
+from app.nats.publisher import set_nats_client
+
+
+class Supervisor:
+    def __init__(self, workers: int):
+        self._count = workers
+        self._ctx = multiprocessing.get_context("spawn")
+
+        # worker id -> (process, supervisor end of the pipe)
+        self._workers: dict[int, tuple] = {}
+        self._interest = InterestTable()
+
+        # control events, published in order by one task
+        self._events: asyncio.Queue = asyncio.Queue()
+        self._stopping = False
+
+        self.restarts = 0
+
+    # ---------------------------------------------------------
+    # Workers
+    # ---------------------------------------------------------
+
+    def _spawn(self, worker_id: int):
+        from app.main import run_worker
+
+        parent_conn, child_conn = self._ctx.Pipe()
+
+        # inherited by the spawned interpreter (per-worker log file)
+        os.environ["GATEWAY_WORKER_ID"] = str(worker_id)
+        proc = self._ctx.Process(
+            target=run_worker,
+            args=(worker_id, child_conn),
+            name=f"gateway-w{worker_id}",
+        )
+        proc.start()
+        child_conn.close()
+
+        self._workers[worker_id] = (proc, parent_conn)
+        asyncio.get_running_loop().add_reader(
+            parent_conn.fileno(), self._on_readable, worker_id, parent_conn
+        )
+        logger.info("👷 Worker %s started (pid=%s)", worker_id, proc.pid)
+
+    def _on_readable(self, worker_id: int, conn):
+        try:
+            while conn.poll():
+                action, subjects = conn.recv()
+                if action == "start":
+                    changed = self._interest.acquire(worker_id, subjects)
+                else:
+                    changed = self._interest.release(worker_id, subjects)
+                if changed:
+                    self._events.put_nowait((action, changed))
+        except (EOFError, OSError):
+            asyncio.get_running_loop().remove_reader(conn.fileno())
+
+    def _reap(self, worker_id: int):
+        proc, conn = self._workers.pop(worker_id)
+
+        loop = asyncio.get_running_loop()
+        try:
+            loop.remove_reader(conn.fileno())
+        except (OSError, ValueError):
+            pass
+        # interest reported before the worker died
+        self._on_readable(worker_id, conn)
+        conn.close()
+
+        stopped = self._interest.drop_worker(worker_id)
+        if stopped:
+            self._events.put_nowait(("stop", stopped))
+
+        logger.log(
+            logging.INFO if self._stopping else logging.WARNING,
+            "Worker %s exited (code=%s), released %s subject(s)",
+            worker_id,
+            proc.exitcode,
+            len(stopped),
+        )
+
+    async def _monitor(self):
+        while not self._stopping:
+            await asyncio.sleep(0.5)
+            for worker_id, (proc, _) in list(self._workers.items()):
+                if proc.is_alive() or self._stopping:
+                    continue
+
+                self._reap(worker_id)
+                self.restarts += 1
+                await asyncio.sleep(settings.WORKER_RESTART_DELAY)
+                if not self._stopping:
+                    self._spawn(worker_id)
+
+    async def _publish_events(self):
+        while True:
+            action, subjects = await self._events.get()
+            try:
+                await publish_interest(action, subjects)
+            finally:
+                self._events.task_done()
+
+    # ---------------------------------------------------------
+    # Lifecycle
+    # ---------------------------------------------------------
+
+    async def _shutdown_workers(self):
+        for proc, _ in self._workers.values():
+            if proc.is_alive():
+                proc.terminate()  # SIGTERM -> graceful worker shutdown
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.WORKER_SHUTDOWN_TIMEOUT
+        while any(p.is_alive() for p, _ in self._workers.values()):
+            if loop.time() > deadline:
+                for proc, _ in self._workers.values():
+                    if proc.is_alive():
+                        logger.warning("Killing worker %s", proc.name)
+                        proc.kill()
+                break
+            await asyncio.sleep(0.1)
+
+        for worker_id in list(self._workers):
+            self._reap(worker_id)
+
+    async def run(self):
+        logger.info("🚀 Starting gateway supervisor with %s workers", self._count)
+
+        nc = await nats.connect(settings.NATS_URL, name="smart-gateway-supervisor")
+        set_nats_client(nc)
+        cluster = await start_cluster(nc)
+
+        publisher = asyncio.create_task(self._publish_events())
+        for worker_id in range(self._count):
+            self._spawn(worker_id)
+        monitor = asyncio.create_task(self._monitor())
+
+        stop_event = asyncio.Event()
+
+        def _shutdown():
+            logger.warning("🛑 Shutdown signal received, stopping workers")
+            stop_event.set()
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, _shutdown)
+
+        await stop_event.wait()
+
+        self._stopping = True
+        monitor.cancel()
+        await self._shutdown_workers()
+
+        # flush remaining stop events
+        await self._events.join()
+        publisher.cancel()
+        if cluster is not None:
+            await cluster.close()
+
+        await nc.close()
+        logger.info("👋 Supervisor stopped (restarts=%s)", self.restarts)
+
+
+def run_supervisor(workers: int):
+    run(Supervisor(workers).run())
@@ -0,0 +1,63 @@
+import heapq
+
+
+class DeadlineQueue:
+    """
+    Min-heap of per-key deadlines with lazy deletion.
+
+    Re-scheduling a key only pushes a new heap entry; stale entries are
+    skipped when they reach the top (and compacted when they pile up),
+    so set/discard are O(log n) and finding the next deadline is O(1)
+    amortized.
+    """
+
+    def __init__(self):
+        self._heap: list[tuple[float, str]] = []
+        self._deadlines: dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def __contains__(self, key) -> bool:
+        return key in self._deadlines
+
+    def get(self, key) -> float | None:
+        return self._deadlines.get(key)
+
+    def set(self, key, deadline: float):
+        self._deadlines[key] = deadline
+        heapq.heappush(self._heap, (deadline, key))
+
+        if len(self._heap) > 2 * len(self._deadlines) + 1024:
+            self._compact()
+
+    def discard(self, key):
+        self._deadlines.pop(key, None)
+
+    def next_deadline(self) -> float | None:
+        heap = self._heap
+        while heap:
+            deadline, key = heap[0]
+            if self._deadlines.get(key) == deadline:
+                return deadline
+            heapq.heappop(heap)
+        return None
+
+    def pop_expired(self, now: float) -> list:
+        """
+        Remove and return every key whose deadline is <= now.
+        """
+        expired = []
+        heap = self._heap
+        deadlines = self._deadlines
+
+        while heap and heap[0][0] <= now:
+            deadline, key = heapq.heappop(heap)
+            if deadlines.get(key) == deadline:
+                del deadlines[key]
+                expired.append(key)
+        return expired
+
+    def _compact(self):
+        self._heap = [(d, k) for k, d in self._deadlines.items()]
+        heapq.heapify(self._heap)
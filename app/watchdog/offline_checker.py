@@ -1,25 +1,127 @@
 import time
 import asyncio
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.core.metrics import offline_events
+from app.nats.status_store import OFFLINE
+from app.watchdog.deadlines import DeadlineQueue
 from app.ws.send import send_to_subscribers
 
+# yield to the event loop every N offline events of a mass outage
+OFFLINE_BATCH = 500
+
+
+class OfflineWatchdog:
+    """
+    Marks devices offline exactly when their heartbeat deadline passes.
+
+    Every heartbeat re-schedules the device in a deadline heap, so the
+    watchdog only wakes up for devices that actually expire instead of
+    scanning all of `last_seen` on a fixed tick.
+    """
+
+    def __init__(self, store):
+        # app.nats.status_store.StatusStore
+        self._store = store
+
+        self._deadlines = DeadlineQueue()
+        # uuid -> timeout override (seconds)
+        self._timeouts: dict[str, float] = {}
+
+        self._wakeup = asyncio.Event()
+        self._sleep_until: float | None = None
+
+        self.offline_events = 0
+
+    # ---------------------------------------------------------
+    # Scheduling
+    # ---------------------------------------------------------
+
+    def timeout_for(self, uuid: str) -> float:
+        return self._timeouts.get(uuid, settings.DEVICE_OFFLINE_TIMEOUT)
+
+    def set_timeout(self, uuid: str, seconds: float | None):
+        """
+        Override offline timeout for one device (None -> default).
+        """
+        if seconds is None:
+            self._timeouts.pop(uuid, None)
+        else:
+            self._timeouts[uuid] = seconds
+
+        if self._store.status(uuid) not in (None, OFFLINE):
+            self.touch(uuid, self._store.last_seen(uuid))
+
+    def touch(self, uuid: str, ts: float | None = None):
+        """
+        Device seen at ts: (re)schedule its offline deadline.
+        """
+        if ts is None:
+            ts = time.time()
+
+        deadline = ts + self.timeout_for(uuid)
+        self._deadlines.set(uuid, deadline)
+
+        # only wake the loop if this deadline is earlier than its sleep
+        if self._sleep_until is None or deadline < self._sleep_until:
+            self._wakeup.set()
+
+    def forget(self, uuid: str):
+        self._deadlines.discard(uuid)
+        self._timeouts.pop(uuid, None)
+
+    # ---------------------------------------------------------
+    # Loop
+    # ---------------------------------------------------------
+
+    async def run(self):
+        # devices known before the loop started (e.g. snapshot warm start)
+        for uuid, ts in list(self._store.online()):
+            if uuid not in self._deadlines:
+                self.touch(uuid, ts)
+
+        while True:
+            self._wakeup.clear()
+            deadline = self._deadlines.next_deadline()
+
+            if deadline is None:
+                self._sleep_until = None
+                await self._wakeup.wait()
+                continue
+
+            delay = deadline - time.time()
+            if delay > 0:
+                self._sleep_until = deadline
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._sleep_until = None
+            expired = self._deadlines.pop_expired(time.time())
+            if expired:
+                await self._mark_offline(expired)
 
-async def watchdog(last_seen: dict, raspberry_status: dict):
-    while True:
-        now = time.time()
+    async def _mark_offline(self, uuids: list[str]):
+        now = int(time.time())
 
-        for uuid, ts in list(last_seen.items()):
-            if now - ts > 60:
-                raspberry_status[uuid] = "offline"
+        for i, uuid in enumerate(uuids, 1):
+            self._store.set_status(uuid, OFFLINE)
 
-                await send_to_subscribers(uuid, {
-                    "type": "raspberry_heartbeat",
-                    "data": {
-                        "uuid": uuid,
-                        "status": "offline",
-                        "timestamp": int(time.time())
-                    }
-                })
+            await send_to_subscribers(uuid, {
+                "type": "raspberry_heartbeat",
+                "data": {
+                    "uuid": uuid,
+                    "status": OFFLINE,
+                    "timestamp": now
+                }
+            })
 
-                del last_seen[uuid]
+            if i % OFFLINE_BATCH == 0:
+                await asyncio.sleep(0)
 
-        await asyncio.sleep(10)
+        self.offline_events += len(uuids)
+        offline_events.inc(amount=len(uuids))
+        logger.info("[watchdog] %s device(s) went offline", len(uuids))
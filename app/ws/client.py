@@ -0,0 +1,522 @@
+import asyncio
+import time
+from collections import deque
+
+from websockets.exceptions import ConnectionClosed
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.core.metrics import (
+    fanout_latency,
+    ws_batched_messages,
+    ws_frames_dropped,
+    ws_frames_out,
+    ws_send_failed,
+)
+from app.ws import downsample
+from app.ws.codecs import JSON
+from app.ws.subscriptions import ws_label
+from app.nats.subjects import is_wildcard, subject_matches
+
+
+# -------------------------------------------------------------------
+# Overflow policies
+# -------------------------------------------------------------------
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+DISCONNECT = "disconnect"
+
+# frames queued across ALL connected clients (backpressure signal for
+# consumers); frames buffered for suspended sessions are counted apart
+_backlog = 0
+_buffered = 0
+
+
+def total_backlog() -> int:
+    return _backlog
+
+
+def total_buffered() -> int:
+    return _buffered
+
+
+class _Slot:
+    """
+    Queue entry of a conflated subject: holds only the newest frame,
+    replaced in place while it waits in the queue.
+    """
+
+    __slots__ = ("subject", "frame")
+
+    def __init__(self, subject: str, frame):
+        self.subject = subject
+        self.frame = frame
+
+
+class WsClient:
+    """
+    WS connection with a dedicated writer task.
+
+    Fan-out only enqueues into a bounded per-connection queue (never
+    blocks); the writer task drains it in order. When the queue is full
+    the overflow policy decides what to drop.
+    """
+
+    def __init__(self, ws, codec=JSON):
+        self.ws = ws
+        self.label = ws_label(ws)
+        # wire codec (negotiated: subprotocol / hello)
+        self.codec = codec
+        # resume token (app.ws.sessions), None without sessions
+        self.session: str | None = None
+        # WS -> NATS commands (app.ws.commands): allowed subject
+        # prefixes (None = server default) and requests in flight
+        self.publish_prefixes: tuple | None = None
+        self.inflight = 0
+
+        self._queue: deque = deque()
+        self._max_queue = settings.WS_QUEUE_SIZE
+        # suspended session (queue counted in _buffered, not _backlog)
+        self._detached = False
+        self._policy = settings.WS_OVERFLOW_POLICY
+        self._max_drops = settings.WS_MAX_DROPS
+
+        # subscription (subject / pattern) -> SubscriptionOptions
+        self._options: dict = {}
+        # concrete subject -> resolved options (cache)
+        self._resolved: dict = {}
+        # conflated subject -> pending _Slot in queue
+        self._pending: dict[str, _Slot] = {}
+
+        # micro-batching (window 0 -> one WS frame per message)
+        self.batch_window = settings.WS_BATCH_WINDOW_MS / 1000
+        self.batch_max = settings.WS_BATCH_MAX
+        self._flush_waiter: asyncio.Future | None = None
+        self._flush_at = 0
+
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._close_task: asyncio.Task | None = None
+        self._closed = False
+        self._overflowing = False
+
+        # counters
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.conflated = 0
+
+    @property
+    def remote_address(self):
+        return getattr(self.ws, "remote_address", None)
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    @property
+    def evicted(self) -> bool:
+        """
+        Disconnected by the gateway as a slow consumer.
+        """
+        return self._close_task is not None
+
+    # ---------------------------------------------------------
+    # Lifecycle
+    # ---------------------------------------------------------
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        self._closed = True
+        self._clear_queue()
+
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def detach(self, buffer: int):
+        """
+        Connection lost but the session is kept: stop the writer and
+        buffer the newest `buffer` frames until attach().
+        """
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+        # the writer may have hit ConnectionClosed first
+        self._closed = False
+        self._max_queue = buffer
+        self._policy = DROP_OLDEST
+        while len(self._queue) > buffer:
+            self._pop()
+
+        # buffered frames must not hold back consumers (backpressure)
+        self._move_count(detached=True)
+
+    def attach(self, ws, marker=None):
+        """
+        Resume the session on a new connection; queued frames are sent
+        first, then marker (a control Frame), which is queued even when
+        the buffer is full.
+        """
+        self._move_count(detached=False)
+
+        self.ws = ws
+        self.label = ws_label(ws)
+        self._max_queue = settings.WS_QUEUE_SIZE
+        self._policy = settings.WS_OVERFLOW_POLICY
+        self._overflowing = False
+        if marker is not None:
+            self._queue.append(marker)
+            self._count(1)
+        self.start()
+        if self._queue:
+            self._wakeup.set()
+
+    def _move_count(self, detached: bool):
+        if self._detached != detached:
+            queued = len(self._queue)
+            self._count(-queued)
+            self._detached = detached
+            self._count(queued)
+
+    # ---------------------------------------------------------
+    # Subscription options
+    # ---------------------------------------------------------
+
+    def set_options(self, subject: str, options):
+        """
+        Attach SubscriptionOptions (or None for defaults) to subject.
+        """
+        if options is None:
+            self.drop_options(subject)
+            return
+
+        self._options[subject] = options
+        self._resolved.clear()
+
+    def set_batching(self, window_ms: float, max_messages: int | None = None):
+        """
+        Opt in / out of micro-batching (window_ms 0 -> off).
+        """
+        window_ms = min(max(0.0, window_ms), settings.WS_BATCH_MAX_WINDOW_MS)
+        self.batch_window = window_ms / 1000
+        if max_messages:
+            self.batch_max = max(1, min(int(max_messages), settings.WS_BATCH_MAX))
+
+    def drop_options(self, subject: str):
+        if self._options.pop(subject, None) is not None:
+            self._resolved.clear()
+
+    def _options_for(self, subject: str):
+        try:
+            return self._resolved[subject]
+        except KeyError:
+            pass
+
+        options = self._options.get(subject)
+        if options is None:
+            for pattern, pattern_options in self._options.items():
+                if is_wildcard(pattern) and subject_matches(pattern, subject):
+                    options = pattern_options
+                    break
+
+        if len(self._resolved) >= 1024:
+            self._resolved.clear()
+        self._resolved[subject] = options
+        return options
+
+    # ---------------------------------------------------------
+    # Publishing (non-blocking)
+    # ---------------------------------------------------------
+
+    def enqueue(self, frame) -> bool:
+        """
+        Queue Frame for delivery.
+
+        Subscriptions with a view get the projected frame (shared by all
+        clients using the same view); rate-limited ones go through their
+        group sampler (app.ws.downsample), which push()es once per window.
+
+        Returns:
+            True  -> queued (or conflated / sampled)
+            False -> dropped (client closed, queue full or filtered out)
+        """
+        if self._closed:
+            return False
+
+        options = self._options_for(frame.subject) if self._options else None
+        if options is None:
+            return self.push(frame)
+
+        if options.view is not None:
+            frame = frame.project(options.view)
+            if frame is None:
+                return False
+
+        if options.max_rate:
+            return downsample.offer(self, frame, options)
+
+        return self.push(frame, options.conflate)
+
+    def push(self, frame, conflate: bool = False) -> bool:
+        """
+        Queue frame as is (options already applied).
+
+        Frames of conflated subscriptions take at most one queue slot
+        per subject: a newer frame replaces the pending one in place.
+
+        Returns:
+            True  -> queued (or conflated into a pending slot)
+            False -> dropped (client closed or queue full)
+        """
+        if self._closed or not self._max_queue:
+            return False
+
+        subject = frame.subject
+        entry = frame
+        if conflate:
+            slot = self._pending.get(subject)
+            if slot is not None:
+                slot.frame = frame
+                self.conflated += 1
+                return True
+            entry = _Slot(subject, frame)
+
+        if len(self._queue) >= self._max_queue and not self._overflow():
+            return False
+
+        if entry is not frame:
+            self._pending[subject] = entry
+        self._queue.append(entry)
+        self._wakeup.set()
+
+        if self._flush_waiter is not None and (
+            frame.urgent or len(self._queue) >= self._flush_at
+        ):
+            self._flush()
+
+        self._count(1)
+        return True
+
+    def _overflow(self) -> bool:
+        """
+        Apply overflow policy to a full queue.
+
+        Returns:
+            True  -> room was made for the new message
+            False -> new message must be dropped
+        """
+        self.dropped += 1
+        ws_frames_dropped.inc()
+
+        if not self._overflowing:
+            self._overflowing = True
+            logger.warning(
+                "WS queue full for %s "
+                "(policy=%s, dropped=%s)",
+                self.label,
+                self._policy,
+                self.dropped,
+            )
+
+        if self._policy == DROP_OLDEST:
+            self._pop()
+            return True
+
+        if self._policy == DISCONNECT and self.dropped >= self._max_drops:
+            self._disconnect()
+
+        return False
+
+    def _disconnect(self):
+        if self._closed:
+            return
+
+        self._closed = True
+        self._clear_queue()
+        logger.warning(
+            "Disconnecting slow consumer %s "
+            "after %s dropped message(s)",
+            self.label,
+            self.dropped,
+        )
+        self._close_task = asyncio.create_task(
+            self.ws.close(code=1008, reason="slow consumer")
+        )
+
+    def _pop(self):
+        """
+        Pop the oldest queued frame (resolving conflated slots).
+        """
+        self._count(-1)
+
+        entry = self._queue.popleft()
+        if type(entry) is _Slot:
+            del self._pending[entry.subject]
+            return entry.frame
+        return entry
+
+    def _count(self, n: int):
+        global _backlog, _buffered
+        if self._detached:
+            _buffered += n
+        else:
+            _backlog += n
+
+    def _clear_queue(self):
+        self._count(-len(self._queue))
+
+        self._queue.clear()
+        self._pending.clear()
+
+    # ---------------------------------------------------------
+    # Writer task
+    # ---------------------------------------------------------
+
+    async def _send_one(self, frame) -> bool:
+        """
+        Send frame to the WS client.
+
+        Returns:
+            True  -> delivered
+            False -> failed
+        """
+        try:
+            await self.ws.send(frame.encode(self.codec))
+            self.sent += 1
+            ws_frames_out.inc()
+            if frame.received_at is not None:
+                fanout_latency.observe(time.perf_counter() - frame.received_at)
+            return True
+        except ConnectionClosed:
+            raise
+        except Exception as e:
+            self.failed += 1
+            ws_send_failed.inc()
+            logger.warning("WS send failed to %s: %s", self.label, e)
+        return False
+
+    def _flush(self):
+        waiter = self._flush_waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def _take(self, limit: int) -> list:
+        """
+        Pop up to limit frames, stopping after an urgent one.
+        """
+        batch = []
+        queue = self._queue
+        while queue and len(batch) < limit:
+            frame = self._pop()
+            batch.append(frame)
+            if frame.urgent:
+                break
+        return batch
+
+    async def _collect(self) -> list:
+        """
+        Frames for one batch: whatever is queued now plus what arrives
+        within the batch window (cut short by an urgent frame or a full
+        batch).
+        """
+        batch = self._take(self.batch_max)
+        if len(batch) >= self.batch_max or batch[-1].urgent:
+            return batch
+
+        loop = asyncio.get_running_loop()
+        self._flush_at = self.batch_max - len(batch)
+        self._flush_waiter = loop.create_future()
+        timer = loop.call_later(self.batch_window, self._flush)
+        try:
+            await self._flush_waiter
+        finally:
+            timer.cancel()
+            self._flush_waiter = None
+
+        batch.extend(self._take(self.batch_max - len(batch)))
+        return batch
+
+    async def _send_batch(self, batch: list) -> bool:
+        """
+        Send frames as ONE array frame (codec.join).
+
+        Returns:
+            True  -> delivered
+            False -> failed
+        """
+        if len(batch) == 1:
+            return await self._send_one(batch[0])
+
+        # a frame that cannot be encoded is skipped, not the whole batch
+        codec = self.codec
+        frames = []
+        payloads = []
+        for frame in batch:
+            try:
+                payloads.append(frame.encode(codec))
+            except Exception as e:
+                self.failed += 1
+                ws_send_failed.inc()
+                logger.warning(
+                    "Cannot encode %s frame for %s: %s",
+                    frame.subject,
+                    self.label,
+                    e,
+                )
+                continue
+            frames.append(frame)
+
+        if not frames:
+            return False
+
+        try:
+            await self.ws.send(codec.join(payloads))
+        except ConnectionClosed:
+            raise
+        except Exception as e:
+            self.failed += len(frames)
+            ws_send_failed.inc(amount=len(frames))
+            logger.warning("WS batch send failed to %s: %s", self.label, e)
+            return False
+
+        self.sent += len(frames)
+        ws_frames_out.inc()
+        ws_batched_messages.inc(amount=len(frames))
+
+        now = time.perf_counter()
+        for frame in frames:
+            if frame.received_at is not None:
+                fanout_latency.observe(now - frame.received_at)
+        return True
+
+    async def _run(self):
+        queue = self._queue
+
+        try:
+            while True:
+                if not queue:
+                    self._overflowing = False
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+                if self.batch_window > 0:
+                    await self._send_batch(await self._collect())
+                else:
+                    await self._send_one(self._pop())
+
+        except ConnectionClosed:
+            self._closed = True
+            self._clear_queue()
@@ -0,0 +1,74 @@
+# app/ws/codecs.py
+"""
+Wire codecs negotiated per WS connection (subprotocol or `hello`).
+
+    json     -> text frames (default)
+    msgpack  -> binary MessagePack frames (needs `msgpack` installed)
+
+Frames are encoded at most once per codec in use (see Frame.encode).
+"""
+from app.core import jsonlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Codec:
+    """
+    encode(obj) / decode(data) convert one message; join(parts) packs
+    already encoded messages into one array (micro-batching).
+    """
+
+    __slots__ = ("name", "binary", "encode", "decode", "join")
+
+    def __init__(self, name: str, binary: bool, encode, decode, join):
+        self.name = name
+        self.binary = binary
+        self.encode = encode
+        self.decode = decode
+        self.join = join
+
+    def __repr__(self) -> str:
+        return f"Codec({self.name})"
+
+
+JSON = Codec(
+    "json",
+    binary=False,
+    encode=jsonlib.dumps,
+    decode=jsonlib.loads,
+    join=lambda parts: "[" + ",".join(parts) + "]",
+)
+
+CODECS: dict[str, Codec] = {JSON.name: JSON}
+
+if msgpack is not None:
+    _packer = msgpack.Packer()
+
+    MSGPACK = Codec(
+        "msgpack",
+        binary=True,
+        encode=lambda obj: msgpack.packb(obj, use_bin_type=True),
+        decode=lambda data: msgpack.unpackb(data, raw=False),
+        join=lambda parts: _packer.pack_array_header(len(parts)) + b"".join(parts),
+    )
+    CODECS[MSGPACK.name] = MSGPACK
+
+# offered WS subprotocols, in server preference order
+SUBPROTOCOLS = list(CODECS)
+
+
+def get_codec(name) -> Codec | None:
+    return CODECS.get(name) if isinstance(name, str) else None
+
+
+def decode_message(raw, codec: Codec):
+    """
+    Decode one inbound WS message: text frames are always JSON, binary
+    frames use the connection codec.
+    """
+    if isinstance(raw, str) or not codec.binary:
+        return JSON.decode(raw)
+    return codec.decode(raw)
@@ -0,0 +1,200 @@
+# app/ws/commands.py
+"""
+WS -> NATS commands.
+
+    {"action": "publish", "subject": "cmd.dev42.reboot", "data": {...},
+     "id": "optional, acked with {"type": "published"}"}
+
+    {"action": "request", "subject": "cmd.dev42.read", "data": {...},
+     "id": "r1", "timeout": 2.0}
+      -> {"type": "reply", "id": "r1", "subject": ..., "data": ...}
+      -> {"type": "error", "id": "r1", "error": "timeout"}
+
+Subjects must fall under one of the connection's allowed prefixes
+(WS_PUBLISH_PREFIXES, optionally narrowed per connection via hello).
+
+Requests go through nats-py's multiplexed request inbox: ONE wildcard
+`_INBOX.<id>.*` subscription per NATS connection, replies matched by
+token, so no NATS subscription is created per request. Requests run
+as tasks (the read loop never waits for a reply), at most
+WS_MAX_INFLIGHT per connection; the reply is queued to the client that
+sent the request.
+"""
+import asyncio
+import time
+
+from nats.errors import NoRespondersError
+
+from app.core import jsonlib
+from app.core.config import settings
+from app.core.logging import logger
+from app.core.metrics import command_latency, ws_commands
+from app.nats.publisher import get_nats_client
+from app.nats.subjects import is_valid_subject, is_wildcard
+from app.ws.send import send_control
+
+# request tasks (strong refs until done)
+_tasks: set = set()
+
+
+def _normalize(prefix: str) -> str:
+    return prefix.rstrip(">").rstrip(".")
+
+
+_DEFAULT_PREFIXES = tuple(
+    p for p in (_normalize(p) for p in settings.WS_PUBLISH_PREFIXES) if p
+)
+
+
+def _within(prefix: str, subject: str) -> bool:
+    return subject == prefix or subject.startswith(prefix + ".")
+
+
+def prefixes_for(client) -> tuple:
+    if client.publish_prefixes is None:
+        return _DEFAULT_PREFIXES
+    return client.publish_prefixes
+
+
+def narrow(requested) -> tuple:
+    """
+    Per-connection prefixes from hello: only those inside the server
+    allow-list are kept.
+    """
+    if not isinstance(requested, list):
+        return ()
+    prefixes = (_normalize(p) for p in requested if isinstance(p, str))
+    return tuple(
+        p for p in prefixes
+        if p and any(_within(allowed, p) for allowed in _DEFAULT_PREFIXES)
+    )
+
+
+def _fail(client, request_id, error: str, result: str):
+    ws_commands.inc(result)
+    send_control(client, {"type": "error", "id": request_id, "error": error})
+
+
+def _authorize(client, data: dict) -> str | None:
+    """
+    Target subject of a command, or None (error already sent).
+    """
+    subject = data.get("subject")
+    if (
+        not isinstance(subject, str)
+        or is_wildcard(subject)
+        or not is_valid_subject(subject)
+    ):
+        _fail(client, data.get("id"), "invalid subject", "invalid")
+        return None
+
+    if not any(_within(prefix, subject) for prefix in prefixes_for(client)):
+        logger.warning("%s command to %s denied", client.label, subject)
+        _fail(client, data.get("id"), f"subject not allowed: {subject}", "denied")
+        return None
+    return subject
+
+
+def _timeout(value) -> float:
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0:
+        return min(float(value), settings.WS_REQUEST_MAX_TIMEOUT)
+    return settings.WS_REQUEST_TIMEOUT
+
+
+# -------------------------------------------------------------------
+# Actions
+# -------------------------------------------------------------------
+
+async def publish(client, data: dict):
+    request_id = data.get("id")
+    subject = _authorize(client, data)
+    if subject is None:
+        return
+
+    nc = get_nats_client()
+    if nc is None:
+        _fail(client, request_id, "NATS unavailable", "error")
+        return
+
+    try:
+        await nc.publish(subject, jsonlib.dumpb(data.get("data")))
+    except Exception as e:
+        logger.warning("%s publish to %s failed: %s", client.label, subject, e)
+        _fail(client, request_id, "publish failed", "error")
+        return
+
+    ws_commands.inc("published")
+    if request_id is not None:
+        send_control(client, {"type": "published", "id": request_id})
+
+
+def request(client, data: dict):
+    """
+    Start a request; the reply (or error) is queued to client later.
+    """
+    request_id = data.get("id")
+    if request_id is None:
+        _fail(client, None, "request needs an id", "invalid")
+        return
+
+    subject = _authorize(client, data)
+    if subject is None:
+        return
+
+    nc = get_nats_client()
+    if nc is None:
+        _fail(client, request_id, "NATS unavailable", "error")
+        return
+
+    if client.inflight >= settings.WS_MAX_INFLIGHT:
+        _fail(client, request_id, "too many requests in flight", "busy")
+        return
+
+    client.inflight += 1
+    task = asyncio.create_task(
+        _request(
+            nc,
+            client,
+            request_id,
+            subject,
+            jsonlib.dumpb(data.get("data")),
+            _timeout(data.get("timeout")),
+        )
+    )
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def _request(nc, client, request_id, subject: str, payload: bytes, timeout: float):
+    # not cancelled on disconnect: an abandoned request only times out
+    # (cancelling would leak its token in the client's response map)
+    started = time.perf_counter()
+    try:
+        msg = await nc.request(subject, payload, timeout=timeout)
+    except NoRespondersError:
+        _fail(client, request_id, "no responders", "no_responders")
+        return
+    except asyncio.TimeoutError:
+        _fail(client, request_id, "timeout", "timeout")
+        return
+    except Exception as e:
+        logger.warning("%s request to %s failed: %s", client.label, subject, e)
+        _fail(client, request_id, "request failed", "error")
+        return
+    finally:
+        client.inflight -= 1
+
+    command_latency.observe(time.perf_counter() - started)
+    ws_commands.inc("replied")
+
+    try:
+        value = jsonlib.loads(msg.data) if msg.data else None
+    except ValueError:
+        value = msg.data.decode(errors="replace")
+
+    send_control(client, {
+        "type": "reply",
+        "id": request_id,
+        "subject": subject,
+        "data": value,
+    })
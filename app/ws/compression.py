@@ -0,0 +1,128 @@
+# app/ws/compression.py
+"""
+permessage-deflate modes (WS_COMPRESSION):
+
+    shared   -> compress each message ONCE for all clients (default)
+    deflate  -> websockets default: per-connection context takeover
+    off      -> no compression
+
+`shared` negotiates server_no_context_takeover, so the compressed bytes
+of a message depend only on the payload and window size: the first
+connection sending a fan-out message compresses it and every other
+subscriber reuses the cached result. Messages below
+WS_COMPRESSION_MIN_SIZE are sent uncompressed.
+"""
+import dataclasses
+import hashlib
+import zlib
+from collections import OrderedDict
+
+from websockets import frames
+from websockets.extensions.permessage_deflate import (
+    PerMessageDeflate,
+    ServerPerMessageDeflateFactory,
+)
+
+from app.core.config import settings
+from app.core.metrics import ws_deflate
+
+SHARED = "shared"
+DEFLATE = "deflate"
+OFF = "off"
+
+_EMPTY_UNCOMPRESSED_BLOCK = b"\x00\x00\xff\xff"
+
+# (window bits, payload digest) -> compressed payload; keyed by digest
+# so the cache does not hold a second copy of every payload
+_compressed: OrderedDict = OrderedDict()
+_compressed_bytes = 0
+
+
+def _compress(data: bytes, wbits: int, compress_settings: dict) -> bytes:
+    global _compressed_bytes
+
+    key = (wbits, hashlib.blake2b(data, digest_size=16).digest())
+    cached = _compressed.get(key)
+    if cached is not None:
+        _compressed.move_to_end(key)
+        ws_deflate.inc("hit")
+        return cached
+
+    encoder = zlib.compressobj(wbits=-wbits, **compress_settings)
+    compressed = encoder.compress(data) + encoder.flush(zlib.Z_SYNC_FLUSH)
+    if compressed.endswith(_EMPTY_UNCOMPRESSED_BLOCK):
+        compressed = compressed[:-4]
+
+    _compressed[key] = compressed
+    _compressed_bytes += len(compressed)
+    while _compressed and (
+        len(_compressed) > settings.WS_COMPRESSION_CACHE_SIZE
+        or _compressed_bytes > settings.WS_COMPRESSION_CACHE_BYTES
+    ):
+        _, evicted = _compressed.popitem(last=False)
+        _compressed_bytes -= len(evicted)
+    ws_deflate.inc("miss")
+    return compressed
+
+
+class SharedDeflate(PerMessageDeflate):
+    """
+    PerMessageDeflate without local context takeover whose single-frame
+    messages are compressed through the shared cache.
+    """
+
+    def encode(self, frame: frames.Frame) -> frames.Frame:
+        if frame.opcode in frames.CTRL_OPCODES:
+            return frame
+
+        # fragmented messages: stock per-connection path
+        if frame.opcode is frames.OP_CONT or not frame.fin:
+            return super().encode(frame)
+
+        if len(frame.data) < settings.WS_COMPRESSION_MIN_SIZE:
+            # RFC 7692: a message may be sent uncompressed (rsv1 unset)
+            ws_deflate.inc("skipped")
+            return frame
+
+        return dataclasses.replace(
+            frame,
+            rsv1=True,
+            data=_compress(
+                frame.data, self.local_max_window_bits, self.compress_settings
+            ),
+        )
+
+
+class SharedDeflateFactory(ServerPerMessageDeflateFactory):
+    def __init__(self):
+        # same window / memory settings as websockets' default deflate
+        super().__init__(
+            server_no_context_takeover=True,
+            server_max_window_bits=12,
+            client_max_window_bits=12,
+            compress_settings={"memLevel": 5},
+        )
+
+    def process_request_params(self, params, accepted_extensions):
+        response_params, extension = super().process_request_params(
+            params, accepted_extensions
+        )
+        return response_params, SharedDeflate(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            extension.compress_settings,
+        )
+
+
+def serve_options() -> dict:
+    """
+    websockets.serve() keyword arguments for WS_COMPRESSION.
+    """
+    mode = settings.WS_COMPRESSION
+    if mode == SHARED:
+        return {"compression": None, "extensions": [SharedDeflateFactory()]}
+    if mode == OFF:
+        return {"compression": None}
+    return {"compression": "deflate"}
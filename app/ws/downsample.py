@@ -0,0 +1,185 @@
+# app/ws/downsample.py
+"""
+Per-subscription rate limiting (`max_rate`, messages/s per subject).
+
+Clients whose subscriptions resolve to the same (subject, view,
+max_rate, aggregate) share one sampler: every fan-out frame is folded in
+once, and at the end of each window the sampler sends ONE frame to all
+its clients:
+
+    aggregate=latest  -> newest frame of the window (shared, no re-encode)
+    aggregate=stats   -> numeric fields replaced by {min, max, avg}
+
+Samplers of the same window length share one ticker task; samplers and
+tickers disappear after a window without data.
+"""
+import asyncio
+
+from app.core import jsonlib
+from app.core.logging import logger
+from app.ws.frame import Frame
+
+LATEST = "latest"
+STATS = "stats"
+AGGREGATES = (LATEST, STATS)
+
+# window -> _Ticker
+_tickers: dict[float, "_Ticker"] = {}
+
+
+def window_for(max_rate: float) -> float:
+    """
+    Window length for max_rate (ms resolution, so equal rates share a
+    ticker).
+    """
+    return max(0.001, round(1.0 / max_rate, 3))
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class _Sampler:
+    __slots__ = ("key", "aggregate", "window", "clients", "latest", "count", "_stats")
+
+    def __init__(self, key: tuple, aggregate: str, window: float):
+        self.key = key
+        self.aggregate = aggregate
+        self.window = window
+        self.clients: set = set()
+        self.latest: Frame | None = None
+        self.count = 0
+        # field -> [min, max, sum, n]
+        self._stats: dict = {}
+
+    def add(self, frame: Frame):
+        if frame is self.latest:
+            return
+        self.latest = frame
+        self.count += 1
+
+        if self.aggregate != STATS:
+            return
+
+        target = _target(frame.value())
+        if target is None:
+            return
+        stats = self._stats
+        for field, value in target.items():
+            if not _is_number(value):
+                continue
+            entry = stats.get(field)
+            if entry is None:
+                stats[field] = [value, value, value, 1]
+            else:
+                if value < entry[0]:
+                    entry[0] = value
+                if value > entry[1]:
+                    entry[1] = value
+                entry[2] += value
+                entry[3] += 1
+
+    def _aggregated(self) -> Frame:
+        latest = self.latest
+        message = latest.value()
+        target = _target(message)
+        if target is None:
+            return latest
+
+        summary = dict(target)
+        for field, (low, high, total, n) in self._stats.items():
+            summary[field] = {"min": low, "max": high, "avg": total / n}
+
+        if target is message:
+            value = summary
+        else:
+            value = {**message, "data": summary}
+        value["window"] = {"count": self.count, "seconds": self.window}
+
+        return Frame(
+            latest.subject,
+            jsonlib.dumps(value),
+            latest.received_at,
+            value=value,
+            seq=latest.seq,
+        )
+
+    def flush(self) -> bool:
+        """
+        Send the window's frame to every client. Returns False when the
+        window was empty (sampler can be dropped).
+        """
+        if self.latest is None:
+            return False
+
+        try:
+            frame = self._aggregated() if self.aggregate == STATS else self.latest
+        except ValueError as e:
+            logger.warning("Cannot aggregate %s: %s", self.key[0], e)
+            frame = self.latest
+
+        for client in self.clients:
+            client.push(frame)
+
+        self.clients = set()
+        self.latest = None
+        self.count = 0
+        self._stats = {}
+        return True
+
+
+def _target(message):
+    if not isinstance(message, dict):
+        return None
+    data = message.get("data")
+    return data if isinstance(data, dict) else message
+
+
+class _Ticker:
+    """
+    One task per window length, flushing all its samplers per tick.
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self.samplers: dict[tuple, _Sampler] = {}
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time() + self.window
+        try:
+            while self.samplers:
+                await asyncio.sleep(max(0.0, next_tick - loop.time()))
+                next_tick += self.window
+
+                for key, sampler in list(self.samplers.items()):
+                    if not sampler.flush():
+                        del self.samplers[key]
+        finally:
+            if _tickers.get(self.window) is self:
+                del _tickers[self.window]
+
+
+def offer(client, frame: Frame, options) -> bool:
+    """
+    Hand a frame of a rate-limited subscription to its group sampler.
+    """
+    window = window_for(options.max_rate)
+    key = (frame.subject, options.view, window, options.aggregate)
+
+    ticker = _tickers.get(window)
+    if ticker is None:
+        ticker = _tickers[window] = _Ticker(window)
+
+    sampler = ticker.samplers.get(key)
+    if sampler is None:
+        sampler = ticker.samplers[key] = _Sampler(key, options.aggregate, window)
+
+    sampler.add(frame)
+    sampler.clients.add(client)
+    return True
+
+
+def active_samplers() -> int:
+    return sum(len(ticker.samplers) for ticker in _tickers.values())
@@ -0,0 +1,128 @@
+# app/ws/frame.py
+from app.core import jsonlib
+from app.core.logging import logger
+from app.ws.codecs import JSON
+
+_UNSET = object()
+
+
+class Frame:
+    """
+    One WS message, shared by every subscriber (the last-value cache and
+    history keep a stripped copy).
+
+    data is the JSON text encoding; other codecs are encoded lazily, once
+    per frame, by the first client that needs them (Frame.encode).
+
+    received_at is the time.perf_counter() timestamp of the source NATS
+    message (fan-out latency metric); None for replayed frames.
+
+    urgent frames flush a client's pending micro-batch immediately.
+
+    seq is the per-subject sequence number (app.ws.history), None for
+    control replies.
+    """
+
+    __slots__ = (
+        "subject",
+        "data",
+        "received_at",
+        "urgent",
+        "seq",
+        "_value",
+        "_encoded",
+        "_views",
+    )
+
+    def __init__(
+        self,
+        subject: str,
+        data,
+        received_at: float | None = None,
+        value=_UNSET,
+        urgent: bool = False,
+        seq: int | None = None,
+    ):
+        self.subject = subject
+        self.data = data
+        self.received_at = received_at
+        self.urgent = urgent
+        self.seq = seq
+        # decoded message, if the producer had it (saves a parse)
+        self._value = value
+        # codec name -> encoded payload
+        self._encoded: dict | None = None
+        # View -> projected Frame (None: filtered out)
+        self._views: dict | None = None
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def value(self):
+        if self._value is _UNSET:
+            self._value = jsonlib.loads(self.data)
+        return self._value
+
+    def encode(self, codec):
+        """
+        Payload for codec (cached per frame).
+        """
+        if codec is JSON:
+            return self.data
+
+        encoded = self._encoded
+        if encoded is None:
+            encoded = self._encoded = {}
+
+        payload = encoded.get(codec.name)
+        if payload is None:
+            payload = encoded[codec.name] = codec.encode(self.value())
+        return payload
+
+    def project(self, view) -> "Frame | None":
+        """
+        This frame seen through view, computed once per distinct view.
+        Returns None when the view's filter rejects the message.
+        """
+        views = self._views
+        if views is None:
+            views = self._views = {}
+
+        try:
+            return views[view]
+        except KeyError:
+            pass
+
+        try:
+            value = view.apply(self.value())
+        except ValueError as e:
+            logger.warning("Cannot apply %r to %s: %s", view, self.subject, e)
+            value = None
+
+        frame = None
+        if value is not None:
+            frame = Frame(
+                self.subject,
+                jsonlib.dumps(value),
+                self.received_at,
+                value=value,
+                urgent=self.urgent,
+                seq=self.seq,
+            )
+        views[view] = frame
+        return frame
+
+    def stripped(self) -> "Frame":
+        """
+        Copy holding only the JSON payload and seq, without the decoded
+        value or the projection / encoding caches: what the last-value
+        cache and history store, so their byte limits match memory use.
+        """
+        return Frame(self.subject, self.data, seq=self.seq)
+
+    def replay(self) -> "Frame":
+        """
+        Same payload without the receive timestamp (cache / history replay).
+        Encodings are cached on the copy, not on the stored frame.
+        """
+        return Frame(self.subject, self.data, value=self._value, seq=self.seq)
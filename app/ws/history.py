@@ -0,0 +1,319 @@
+# app/ws/history.py
+"""
+Per-subject sequence numbers and bounded history for replay.
+
+Frames of subscribed subjects get a per-subject `seq` (1, 2, ...) so
+clients can detect gaps. Subjects matching HISTORY_SUBJECTS additionally
+keep their last frames in a ring buffer (bounded by HISTORY_MAX_MESSAGES
+and HISTORY_MAX_BYTES per subject, HISTORY_TOTAL_BYTES overall) that
+subscribe can replay from (`since_seq` / `last_n`).
+
+A subject without subscribers for HISTORY_IDLE_SECONDS loses its seq
+and ring. When it is numbered again, its seqs restart above every seq
+evicted so far (with one skipped), so an old since_seq is answered as a
+gap instead of matching new messages.
+
+Sequences are local to one gateway process: clients pass back the
+`instance` id from the hello reply, and a since_seq from another
+instance (or from before a restart) is answered as a gap.
+
+When the ring no longer reaches back to since_seq, the missing messages
+can be fetched from JetStream (HISTORY_JETSTREAM_FALLBACK): they are the
+last N messages of the subject published before the oldest buffered
+frame, searched at most HISTORY_FALLBACK_LOOKBACK seconds back. The
+cutoff compares JetStream timestamps with the gateway clock, and the
+stream also holds messages the gateway never numbered, so fetched
+messages cannot be mapped onto seqs: they are sent without seq, after
+the `history_gap` marker, and may overlap the buffered frames (or miss
+some) by the clock skew between gateway and server.
+"""
+import asyncio
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.nats.subjects import SubjectTrie, subject_matches
+from app.ws.subscriptions import get_subscribers
+
+# identifies this process' sequence space
+INSTANCE_ID = uuid.uuid4().hex[:12]
+
+# idle subjects are looked for at most this often (seconds)
+_SWEEP_INTERVAL = 60.0
+
+
+class _Seq:
+    __slots__ = ("first", "last", "touched")
+
+    def __init__(self, first: int, now: float):
+        # first seq of this numbering (replay never reaches further back)
+        self.first = first
+        self.last = first - 1
+        # last time the subject was subscribed / kept
+        self.touched = now
+
+
+class _Ring:
+    __slots__ = ("entries", "bytes")
+
+    def __init__(self):
+        # (wall time, Frame)
+        self.entries: deque = deque()
+        self.bytes = 0
+
+
+class History:
+    def __init__(
+        self,
+        patterns,
+        max_messages: int,
+        max_bytes: int,
+        total_bytes: int,
+        idle: float,
+    ):
+        self._patterns = SubjectTrie()
+        for pattern in patterns:
+            self._patterns.add(pattern)
+        self._max_messages = max_messages
+        self._max_bytes = max_bytes
+        self._total_bytes = total_bytes
+        self._idle = idle
+
+        # subject -> _Seq (subscribed / history subjects)
+        self._seqs: dict[str, _Seq] = {}
+        # highest seq of an evicted subject
+        self._evicted_max = 0
+        self._swept = time.monotonic()
+
+        # subject -> _Ring (history subjects only), least recently written
+        # first
+        self._rings: OrderedDict[str, _Ring] = OrderedDict()
+        self._bytes = 0
+
+        # subject -> keeps history? (cache)
+        self._wanted: dict[str, bool] = {}
+
+        self._js = None
+
+    def attach_jetstream(self, js):
+        self._js = js
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    # ---------------------------------------------------------
+    # Write side (fan-out path)
+    # ---------------------------------------------------------
+
+    def keeps(self, subject: str) -> bool:
+        wanted = self._wanted.get(subject)
+        if wanted is None:
+            wanted = bool(self._patterns) and bool(self._patterns.match(subject))
+            if len(self._wanted) >= settings.SUBJECT_MATCH_CACHE_SIZE:
+                self._wanted.clear()
+            self._wanted[subject] = wanted
+        return wanted
+
+    def next_seq(self, subject: str, active: bool) -> int | None:
+        """
+        Seq of the next frame of subject. active: the subject has
+        subscribers or keeps history.
+
+        Returns:
+            None -> subject is not numbered (never active / evicted)
+        """
+        now = time.monotonic()
+        if now - self._swept >= _SWEEP_INTERVAL:
+            self._sweep(now)
+
+        entry = self._seqs.get(subject)
+        if entry is None:
+            if not active:
+                return None
+            # skip one seq after evictions: an old since_seq is a gap
+            first = self._evicted_max + 2 if self._evicted_max else 1
+            entry = self._seqs[subject] = _Seq(first, now)
+        elif active:
+            entry.touched = now
+
+        entry.last += 1
+        return entry.last
+
+    def last_seq(self, subject: str) -> int:
+        entry = self._seqs.get(subject)
+        return entry.last if entry is not None else 0
+
+    def first_seq(self, subject: str) -> int:
+        entry = self._seqs.get(subject)
+        return entry.first if entry is not None else 1
+
+    def record(self, frame):
+        subject = frame.subject
+        ring = self._rings.get(subject)
+        if ring is None:
+            ring = self._rings[subject] = _Ring()
+        else:
+            self._rings.move_to_end(subject)
+
+        ring.entries.append((time.time(), frame))
+        ring.bytes += len(frame)
+        self._bytes += len(frame)
+
+        entries = ring.entries
+        while len(entries) > 1 and (
+            len(entries) > self._max_messages or ring.bytes > self._max_bytes
+        ):
+            self._pop_oldest(ring)
+
+        # global cap: oldest frames of the least recently written rings
+        while self._bytes > self._total_bytes:
+            oldest = next(iter(self._rings))
+            ring = self._rings[oldest]
+            if oldest == subject and len(ring.entries) == 1:
+                break
+            self._pop_oldest(ring)
+            if not ring.entries:
+                del self._rings[oldest]
+
+    def _pop_oldest(self, ring: _Ring):
+        _, evicted = ring.entries.popleft()
+        ring.bytes -= len(evicted)
+        self._bytes -= len(evicted)
+
+    def _sweep(self, now: float):
+        """
+        Forget seqs (and rings) of subjects without subscribers for
+        HISTORY_IDLE_SECONDS.
+        """
+        self._swept = now
+        idle = [
+            subject
+            for subject, entry in self._seqs.items()
+            if now - entry.touched > self._idle
+        ]
+
+        evicted = 0
+        for subject in idle:
+            if get_subscribers(subject):
+                self._seqs[subject].touched = now
+                continue
+
+            entry = self._seqs.pop(subject)
+            self._evicted_max = max(self._evicted_max, entry.last)
+            ring = self._rings.pop(subject, None)
+            if ring is not None:
+                self._bytes -= ring.bytes
+            evicted += 1
+
+        if evicted:
+            logger.debug("[history] forgot %s idle subject(s)", evicted)
+
+    # ---------------------------------------------------------
+    # Read side (subscribe)
+    # ---------------------------------------------------------
+
+    def buffered(self) -> int:
+        return sum(len(ring.entries) for ring in self._rings.values())
+
+    def subjects(self, pattern: str) -> list[str]:
+        return [s for s in self._rings if subject_matches(pattern, s)]
+
+    def window(self, subject: str, replay):
+        """
+        Buffered part of a replay request (app.ws.options.ReplayRequest).
+
+        Returns:
+            frames:   buffered frames to replay, in seq order
+            expected: seq the replay should start at (None: unknown,
+                      since_seq is from another instance / a restart)
+            missing:  older messages the buffer no longer has
+        """
+        ring = self._rings.get(subject)
+        frames = [frame for _, frame in ring.entries] if ring else []
+        last = self.last_seq(subject)
+        first_seq = self.first_seq(subject)
+
+        if replay.since_seq is not None:
+            if replay.foreign or replay.since_seq > last:
+                return frames, None, 0
+            expected = replay.since_seq + 1
+            frames = [f for f in frames if f.seq >= expected]
+        else:
+            expected = max(first_seq, last - replay.last_n + 1)
+            frames = frames[-replay.last_n:]
+
+        first = frames[0].seq if frames else last + 1
+        return frames, expected, max(0, first - expected)
+
+    def oldest_time(self, subject: str) -> float | None:
+        ring = self._rings.get(subject)
+        if not ring or not ring.entries:
+            return None
+        return ring.entries[0][0]
+
+    async def fetch_missing(self, subject: str, count: int) -> list[bytes]:
+        """
+        JetStream fallback: payloads of the last `count` messages of
+        subject published before the oldest buffered frame.
+        """
+        if self._js is None or not settings.HISTORY_JETSTREAM_FALLBACK or count <= 0:
+            return []
+
+        from nats.errors import TimeoutError as NatsTimeoutError
+        from nats.js.api import ConsumerConfig, DeliverPolicy
+
+        before = self.oldest_time(subject) or time.time()
+        start = datetime.fromtimestamp(
+            before - settings.HISTORY_FALLBACK_LOOKBACK, timezone.utc
+        )
+
+        payloads: deque = deque(maxlen=count)
+        try:
+            sub = await self._js.subscribe(
+                subject,
+                ordered_consumer=True,
+                config=ConsumerConfig(
+                    deliver_policy=DeliverPolicy.BY_START_TIME,
+                    opt_start_time=start.isoformat().replace("+00:00", "Z"),
+                ),
+            )
+        except Exception as e:
+            logger.warning("[history] JetStream fallback for %s failed: %s", subject, e)
+            return []
+
+        try:
+            while True:
+                msg = await sub.next_msg(timeout=settings.HISTORY_FALLBACK_TIMEOUT)
+                if msg.metadata.timestamp.timestamp() >= before:
+                    break
+                payloads.append(msg.data)
+        except (NatsTimeoutError, asyncio.TimeoutError):
+            pass
+        except Exception as e:
+            logger.warning("[history] JetStream fallback for %s failed: %s", subject, e)
+        finally:
+            try:
+                await sub.unsubscribe()
+            except Exception:
+                pass
+
+        logger.info(
+            "[history] %s: %s/%s missing message(s) from JetStream",
+            subject,
+            len(payloads),
+            count,
+        )
+        return list(payloads)
+
+
+history = History(
+    settings.HISTORY_SUBJECTS,
+    max_messages=settings.HISTORY_MAX_MESSAGES,
+    max_bytes=settings.HISTORY_MAX_BYTES,
+    total_bytes=settings.HISTORY_TOTAL_BYTES,
+    idle=settings.HISTORY_IDLE_SECONDS,
+)
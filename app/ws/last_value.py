@@ -0,0 +1,95 @@
+import time
+from collections import OrderedDict
+
+from app.core.config import settings
+from app.nats.subjects import subject_matches
+
+
+class LastValueCache:
+    """
+    Last pre-encoded frame per subject.
+
+    LRU ordered, bounded by entry count and total size, entries expire
+    after `ttl` seconds. Frames are stored as their JSON payload only
+    (Frame.stripped), so a JSON snapshot costs no extra encoding and the
+    size limit covers what is actually held.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+
+        # subject -> (expires_at, frame)
+        self._entries: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def put(self, subject: str, frame):
+        size = len(frame)
+        if size > self._max_bytes:
+            return
+
+        old = self._entries.pop(subject, None)
+        if old is not None:
+            self._bytes -= len(old[1])
+
+        self._entries[subject] = (time.monotonic() + self._ttl, frame)
+        self._bytes += size
+
+        while (
+            len(self._entries) > self._max_entries
+            or self._bytes > self._max_bytes
+        ):
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    def get(self, subject: str):
+        entry = self._entries.get(subject)
+        if entry is None:
+            return None
+
+        expires_at, frame = entry
+        if expires_at < time.monotonic():
+            self._drop(subject)
+            return None
+
+        self._entries.move_to_end(subject)
+        return frame
+
+    def match(self, pattern: str) -> list[tuple[str, object]]:
+        """
+        Returns (subject, frame) for every live entry matching pattern.
+        """
+        now = time.monotonic()
+        result = []
+        expired = []
+
+        for subject, (expires_at, frame) in self._entries.items():
+            if not subject_matches(pattern, subject):
+                continue
+            if expires_at < now:
+                expired.append(subject)
+            else:
+                result.append((subject, frame))
+
+        for subject in expired:
+            self._drop(subject)
+        return result
+
+    def _drop(self, subject: str):
+        _, frame = self._entries.pop(subject)
+        self._bytes -= len(frame)
+
+
+last_values = LastValueCache(
+    max_entries=settings.LVC_MAX_ENTRIES,
+    max_bytes=settings.LVC_MAX_BYTES,
+    ttl=settings.LVC_TTL,
+)
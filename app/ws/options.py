@@ -0,0 +1,192 @@
+from app.core.config import settings
+from app.nats.subjects import is_wildcard
+from app.ws.downsample import AGGREGATES, LATEST
+from app.ws.history import INSTANCE_ID
+from app.ws.views import InvalidView, View, get_view
+
+
+class InvalidOptions(ValueError):
+    pass
+
+
+class SubscriptionOptions:
+    """
+    Per-subscription delivery options sent with subscribe / subscribe_many.
+
+    Instances are immutable; a subscription without any option uses None.
+
+    view: projection / filter (app.ws.views), shared by every
+    subscription with the same `fields` + `filter`.
+
+    max_rate / aggregate: downsampling (app.ws.downsample).
+    """
+
+    __slots__ = ("conflate", "view", "max_rate", "aggregate")
+
+    def __init__(
+        self,
+        conflate: bool = False,
+        view: View | None = None,
+        max_rate: float | None = None,
+        aggregate: str = LATEST,
+    ):
+        self.conflate = conflate
+        self.view = view
+        self.max_rate = max_rate
+        self.aggregate = aggregate
+
+    def is_default(self) -> bool:
+        return not self.conflate and self.view is None and not self.max_rate
+
+    @classmethod
+    def from_request(cls, data: dict) -> "SubscriptionOptions | None":
+        """
+        Build options from a request dict (unknown keys are ignored).
+        Returns None when every option has its default value.
+        Raises InvalidOptions for malformed values.
+        """
+        try:
+            view = get_view(data.get("fields"), data.get("filter"))
+        except InvalidView as e:
+            raise InvalidOptions(f"invalid view: {e}") from e
+
+        max_rate = data.get("max_rate")
+        if max_rate is not None:
+            if not isinstance(max_rate, (int, float)) or max_rate <= 0:
+                raise InvalidOptions("max_rate must be a positive number")
+            max_rate = min(float(max_rate), settings.WS_MAX_RATE)
+
+        aggregate = data.get("aggregate", LATEST)
+        if aggregate not in AGGREGATES:
+            raise InvalidOptions(f"aggregate must be one of {list(AGGREGATES)}")
+
+        options = cls(
+            conflate=bool(data.get("conflate", False)),
+            view=view,
+            max_rate=max_rate,
+            aggregate=aggregate,
+        )
+        return None if options.is_default() else options
+
+
+class ReplayRequest:
+    """
+    History replay requested with subscribe (app.ws.history):
+
+        since_seq -> every buffered message after since_seq; `instance`
+                     (from the hello reply) says which gateway numbered it
+        last_n    -> the last n messages (also for wildcard subjects)
+    """
+
+    __slots__ = ("since_seq", "last_n", "foreign")
+
+    def __init__(
+        self,
+        since_seq: int | None = None,
+        last_n: int | None = None,
+        foreign: bool = False,
+    ):
+        self.since_seq = since_seq
+        self.last_n = last_n
+        self.foreign = foreign
+
+    @classmethod
+    def from_request(cls, data: dict, subject: str) -> "ReplayRequest | None":
+        """
+        Build a replay request for subject (None when none was asked).
+        Raises InvalidOptions for malformed values.
+        """
+        since_seq = data.get("since_seq")
+        last_n = data.get("last_n")
+        if since_seq is None and last_n is None:
+            return None
+
+        if since_seq is not None and last_n is not None:
+            raise InvalidOptions("since_seq and last_n are exclusive")
+
+        if since_seq is not None:
+            if not _is_int(since_seq) or since_seq < 0:
+                raise InvalidOptions("since_seq must be a non-negative integer")
+            if is_wildcard(subject):
+                raise InvalidOptions("since_seq needs a concrete subject")
+            instance = data.get("instance")
+            return cls(
+                since_seq=since_seq,
+                foreign=instance is not None and instance != INSTANCE_ID,
+            )
+
+        if not _is_int(last_n) or last_n <= 0:
+            raise InvalidOptions("last_n must be a positive integer")
+        return cls(last_n=min(last_n, settings.HISTORY_MAX_MESSAGES))
+
+
+def _is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def parse_batching(data: dict, window_ms: float) -> tuple[float, int | None]:
+    """
+    batch_ms / batch_max of a hello (a missing batch_ms keeps window_ms).
+    Raises InvalidOptions for malformed values.
+    """
+    batch_ms = data.get("batch_ms", window_ms)
+    if (
+        not isinstance(batch_ms, (int, float))
+        or isinstance(batch_ms, bool)
+        or not batch_ms >= 0
+    ):
+        raise InvalidOptions("batch_ms must be a non-negative number")
+
+    batch_max = data.get("batch_max")
+    if batch_max is not None and (not _is_int(batch_max) or batch_max <= 0):
+        raise InvalidOptions("batch_max must be a positive integer")
+    return float(batch_ms), batch_max
+
+
+def parse_replays(data: dict) -> dict:
+    """
+    Replay requests of a subscribe_many `subjects` list (same item rules
+    as parse_subscriptions).
+
+    Returns:
+        dict[subject, ReplayRequest] (subjects without replay omitted)
+    """
+    replays = {}
+    for item in data.get("subjects", []):
+        if isinstance(item, dict):
+            subject = item.get("subject")
+            merged = {**data, **item}
+        else:
+            subject = item
+            merged = data
+
+        if isinstance(subject, str):
+            replay = ReplayRequest.from_request(merged, subject)
+            if replay is not None:
+                replays[subject] = replay
+    return replays
+
+
+def parse_subscriptions(data: dict) -> dict:
+    """
+    Parse the `subjects` list of subscribe_many / unsubscribe_many.
+
+    Items are either plain subjects or objects with a `subject` key and
+    per-subscription options; options given on the request itself act
+    as defaults for every item.
+
+    Returns:
+        dict[subject, SubscriptionOptions | None]
+    """
+    requested = {}
+    for item in data.get("subjects", []):
+        if isinstance(item, dict):
+            subject = item.get("subject")
+            options = SubscriptionOptions.from_request({**data, **item})
+        else:
+            subject = item
+            options = SubscriptionOptions.from_request(data)
+
+        if isinstance(subject, str):
+            requested[subject] = options
+    return requested
@@ -1,72 +1,325 @@
-import json
-import asyncio
+import logging
+import time
+from functools import lru_cache
 
-from app.ws.subscriptions import (
-    get_subscribers,
-    ws_label,
-)
-from app.core.logging import logger
+from app.core import jsonlib
+from app.core.config import settings
+from app.ws.subscriptions import get_subscribers
+from app.ws.frame import Frame
+from app.ws.last_value import last_values
+from app.ws.history import INSTANCE_ID, history
+from app.nats.subjects import is_wildcard
+from app.core.logging import logger, log_sampled
 
 
-SEND_TIMEOUT = 1.0  # seconds
+_validate_counter = 0
 
+_FLUSH_TYPES = frozenset(settings.WS_BATCH_FLUSH_TYPES)
 
-async def _send_one(ws, msg: str, subject: str) -> bool:
+
+# -------------------------------------------------------------------
+# Envelope encoding
+# -------------------------------------------------------------------
+
+@lru_cache(maxsize=4096)
+def _envelope_prefix(subject: str) -> str:
+    """
+    JSON prefix of the {"subject", "seq", "data"} envelope for subject.
+    Same (compact) layout as jsonlib.dumps() of the envelope dict.
     """
-    Send message to single WS client.
+    return '{"subject":' + jsonlib.dumps(subject)
 
-    Returns:
-        True  -> delivered
-        False -> failed / timeout
+
+def _payload_json(payload: bytes, validate: bool) -> str:
+    """
+    JSON text of a raw NATS payload. With validate the payload is parsed
+    first. Payloads that are not valid UTF-8 are always parsed (undecodable
+    bytes replaced) and re-encoded. Raises ValueError for invalid JSON.
     """
     try:
-        await asyncio.wait_for(ws.send(msg), timeout=SEND_TIMEOUT)
+        data = payload.decode()
+    except UnicodeDecodeError:
+        return jsonlib.dumps(jsonlib.loads(payload.decode(errors="replace")))
+
+    if validate:
+        jsonlib.loads(data)
+    return data
+
+
+def _splice(subject: str, seq: int | None, data: str) -> str:
+    prefix = _envelope_prefix(subject)
+    if seq is not None:
+        prefix += ',"seq":' + str(seq)
+    return prefix + ',"data":' + data + "}"
+
+
+def encode_envelope(
+    subject: str,
+    payload: bytes,
+    seq: int | None,
+    validate: bool = False,
+) -> str:
+    """
+    Build {"subject": ..., "seq": N, "data": <payload>} by splicing the raw
+    (already JSON) NATS payload between the cached prefix and suffix.
+    "seq" is left out for unnumbered subjects (seq None).
+
+    Raises ValueError for invalid JSON (see _payload_json).
+    """
+    return _splice(subject, seq, _payload_json(payload, validate))
+
+
+def _should_validate() -> bool:
+    global _validate_counter
+
+    every = settings.NATS_VALIDATE_EVERY
+    if every <= 0:
+        return False
+
+    _validate_counter += 1
+    if _validate_counter >= every:
+        _validate_counter = 0
         return True
-    except asyncio.TimeoutError:
-        logger.warning(
-            f"WS send timeout to {ws_label(ws)} for subject {subject}"
-        )
-    except Exception as e:
-        logger.warning(
-            f"WS send failed to {ws_label(ws)} "
-            f"for subject {subject}: {e}"
-        )
     return False
 
 
-async def send_to_subscribers(subject: str, data: dict):
+# -------------------------------------------------------------------
+# Delivery
+# -------------------------------------------------------------------
+
+def _fan_out(frame: Frame, subs):
+    """
+    Enqueue one shared frame to every subscriber's writer.
+    Never blocks: slow clients are handled by their own queue policy.
+    """
+    queued = 0
+    for client in subs:
+        if client.enqueue(frame):
+            queued += 1
+
+    subject = frame.subject
+    log_sampled(
+        logging.DEBUG,
+        subject,
+        "Queued event for subject %s to %s/%s WS subscriber(s)",
+        subject,
+        queued,
+        len(subs),
+    )
+
+
+def deliver_last_values(client, subjects) -> int:
+    """
+    Send cached last frames of subjects (or wildcard patterns) to a
+    client that just subscribed to them.
+    """
+    if not settings.LVC_ENABLED:
+        return 0
+
+    delivered = 0
+    for subject in subjects:
+        if is_wildcard(subject):
+            cached = last_values.match(subject)
+        else:
+            frame = last_values.get(subject)
+            cached = [(subject, frame)] if frame is not None else ()
+
+        for _, frame in cached:
+            if client.enqueue(frame.replay()):
+                delivered += 1
+    return delivered
+
+
+def control_frame(message: dict) -> Frame:
+    """
+    Frame of a control message (not tied to a subject).
+    """
+    return Frame("", jsonlib.dumps(message), value=message, urgent=True)
+
+
+def send_control(client, message: dict):
+    """
+    Queue a control message for client.
+    """
+    client.enqueue(control_frame(message))
+
+
+def _history_frames(subject: str, payloads: list) -> list[Frame]:
+    """
+    Frames for raw NATS payloads fetched from JetStream. They carry no
+    seq: the gateway never numbered them (see app.ws.history).
+    """
+    frames = []
+    for payload in payloads:
+        try:
+            if settings.NATS_PASSTHROUGH:
+                frame = Frame(
+                    subject, encode_envelope(subject, payload, None, validate=True)
+                )
+            else:
+                value = {"subject": subject, "data": jsonlib.loads(payload)}
+                frame = Frame(subject, jsonlib.dumps(value), value=value)
+        except ValueError as e:
+            logger.warning("Invalid JSON in history of %s: %s", subject, e)
+        else:
+            frames.append(frame)
+    return frames
+
+
+async def prefetch_history(subject: str, replay) -> list[Frame]:
+    """
+    JetStream fallback for the part of a replay the history buffer no
+    longer holds (empty when not needed / not enabled).
+    """
+    if is_wildcard(subject) or not history.keeps(subject):
+        return []
+
+    _, _, missing = history.window(subject, replay)
+    if not missing:
+        return []
+
+    payloads = await history.fetch_missing(
+        subject, min(missing, settings.HISTORY_MAX_MESSAGES)
+    )
+    return _history_frames(subject, payloads)
+
+
+def deliver_history(client, subject: str, replay, prefetched=()) -> int:
+    """
+    Replay history of subject (or of every buffered subject matching a
+    wildcard) to a client that just subscribed. Must run without an await
+    after the subscription was registered, so live frames follow the
+    replay without overlap.
+
+    A `history_gap` control message precedes the replay of a subject whose
+    history does not reach back to the requested seq. Frames fetched from
+    JetStream (prefetched) follow it, without seq ("fetched" says how
+    many), then the buffered frames.
+    """
+    subjects = history.subjects(subject) if is_wildcard(subject) else [subject]
+
+    delivered = 0
+    for name in subjects:
+        frames, expected, _ = history.window(name, replay)
+
+        first = frames[0].seq if frames else history.last_seq(name) + 1
+        if expected is None or first > expected:
+            older = prefetched if expected is not None and name == subject else ()
+            send_control(client, {
+                "type": "history_gap",
+                "subject": name,
+                "expected_seq": expected,
+                "first_seq": first,
+                "fetched": len(older),
+                "instance": INSTANCE_ID,
+            })
+            frames = [*older, *frames]
+
+        for frame in frames:
+            if client.enqueue(frame.replay()):
+                delivered += 1
+    return delivered
+
+
+async def send_to_subscribers(
+    subject: str,
+    data: dict,
+    received_at: float | None = None,
+):
+    """
+    Fan out a message built by the gateway. data is the envelope (device
+    payloads go under its "data" key); "seq" is added to it.
+    """
     # ---------------------------------------------------------
     # Snapshot subscribers (SAFE)
     # ---------------------------------------------------------
-    subs = await get_subscribers(subject)
-    if not subs:
-        logger.debug(f"No WS subscribers for subject {subject}")
+    subs = get_subscribers(subject)
+    keep = history.keeps(subject)
+    store = settings.LVC_ENABLED or keep
+    seq = history.next_seq(subject, bool(subs) or keep)
+
+    if not subs and not store:
+        log_sampled(
+            logging.DEBUG, subject, "No WS subscribers for subject %s", subject
+        )
         return
 
-    msg = json.dumps(data)
+    if seq is not None and isinstance(data, dict):
+        data = {**data, "seq": seq}
 
-    logger.info(
-        f"Sending event for subject {subject} "
-        f"to {len(subs)} WS client(s): "
-        f"{[ws_label(ws) for ws in subs]}"
+    frame = Frame(
+        subject,
+        jsonlib.dumps(data),
+        received_at if received_at is not None else time.perf_counter(),
+        value=data,
+        urgent=isinstance(data, dict) and data.get("type") in _FLUSH_TYPES,
+        seq=seq,
     )
+    if store:
+        stored = frame.stripped()
+        if settings.LVC_ENABLED:
+            last_values.put(subject, stored)
+        if keep:
+            history.record(stored)
 
-    # ---------------------------------------------------------
-    # Fan-out PARALLEL (isolated clients)
-    # ---------------------------------------------------------
-    tasks = [
-        _send_one(ws, msg, subject)
-        for ws in subs
-    ]
-
-    results = await asyncio.gather(
-        *tasks,
-        return_exceptions=False,
-    )
+    if subs:
+        _fan_out(frame, subs)
+
+
+async def forward_nats_payload(
+    subject: str,
+    payload: bytes,
+    received_at: float | None = None,
+):
+    """
+    Zero-parse forwarding of a raw NATS payload.
+
+    The payload is spliced into the envelope without a JSON parse / re-encode
+    and encoded once for all subscribers. Payloads that are stored (last-value
+    cache / history, replayed later) are always validated; the others only
+    every NATS_VALIDATE_EVERY-th message, so invalid JSON can still reach live
+    subscribers. Non-UTF-8 payloads are always re-encoded.
+    """
+    if not payload:
+        logger.warning("Empty NATS payload for subject %s, dropped", subject)
+        return
+
+    subs = get_subscribers(subject)
+    keep = history.keeps(subject)
+    store = settings.LVC_ENABLED or keep
+
+    if not subs and not store:
+        # numbered subjects still count the message (gap on resubscribe)
+        history.next_seq(subject, False)
+        log_sampled(
+            logging.DEBUG, subject, "No WS subscribers for subject %s", subject
+        )
+        return
 
-    delivered = sum(1 for r in results if r)
+    try:
+        data = _payload_json(payload, store or _should_validate())
+    except ValueError as e:
+        logger.warning(
+            "Invalid JSON payload for subject %s, dropped: %s",
+            subject,
+            e,
+        )
+        return
 
-    logger.info(
-        f"Sent event for subject {subject} "
-        f"to {delivered}/{len(subs)} WS subscriber(s)"
+    # numbered only once the frame exists: a dropped payload leaves no gap
+    seq = history.next_seq(subject, bool(subs) or keep)
+    frame = Frame(
+        subject,
+        _splice(subject, seq, data),
+        received_at if received_at is not None else time.perf_counter(),
+        seq=seq,
     )
+    if store:
+        stored = frame.stripped()
+        if settings.LVC_ENABLED:
+            last_values.put(subject, stored)
+        if keep:
+            history.record(stored)
+
+    if subs:
+        _fan_out(frame, subs)
@@ -0,0 +1,142 @@
+# app/ws/sessions.py
+"""
+Resumable sessions (SESSION_TTL > 0).
+
+Every connection gets a resume token (`{"type": "session"}` message on
+connect). When the socket drops, the client (WsClient) is NOT removed
+from the registry: its subscriptions - and the NATS subjects behind
+them - stay alive for SESSION_TTL seconds while up to SESSION_BUFFER
+messages are buffered. A reconnect sending
+
+    {"action": "resume", "token": "..."}
+
+as its first message gets the old WsClient re-attached to the new
+socket (one dict lookup, no registry / NATS work); buffered messages
+are flushed, followed by a `{"type": "resumed"}` reply.
+
+Sessions live in the process that accepted the connection; in worker
+mode a reconnect landing on another worker gets an error and
+re-subscribes.
+"""
+import asyncio
+import secrets
+import time
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.watchdog.deadlines import DeadlineQueue
+
+
+class SessionStore:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        # token -> WsClient (connected or suspended)
+        self._clients: dict = {}
+        # token -> expiry of suspended sessions
+        self._deadlines = DeadlineQueue()
+        # token -> coroutine function releasing the session
+        self._on_expire: dict = {}
+
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    @property
+    def suspended(self) -> int:
+        return len(self._deadlines)
+
+    # ---------------------------------------------------------
+    # Sessions
+    # ---------------------------------------------------------
+
+    def issue(self, client) -> str:
+        token = secrets.token_urlsafe(18)
+        client.session = token
+        self._clients[token] = client
+        return token
+
+    def suspend(self, client, on_expire) -> bool:
+        """
+        Keep a disconnected client's session for the TTL.
+
+        Returns:
+            False -> no session (caller releases the client now)
+        """
+        token = client.session
+        if token is None or self._clients.get(token) is not client:
+            return False
+
+        self._deadlines.set(token, time.monotonic() + self.ttl)
+        self._on_expire[token] = on_expire
+        self._ensure_task()
+        return True
+
+    def resume(self, token):
+        """
+        Take a suspended session back. Returns its WsClient or None
+        (unknown / expired / still connected).
+        """
+        if not isinstance(token, str) or token not in self._deadlines:
+            return None
+
+        self._deadlines.discard(token)
+        self._on_expire.pop(token, None)
+        return self._clients[token]
+
+    def drop(self, client):
+        token = client.session
+        if token is not None and self._clients.get(token) is client:
+            del self._clients[token]
+            self._deadlines.discard(token)
+            self._on_expire.pop(token, None)
+
+    # ---------------------------------------------------------
+    # Expiry (one task for all sessions)
+    # ---------------------------------------------------------
+
+    def _ensure_task(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        # fixed TTL: new deadlines are never earlier than the one we
+        # sleep for, so no wakeup is needed when sessions are added
+        while True:
+            deadline = self._deadlines.next_deadline()
+            if deadline is None:
+                return
+
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            for token in self._deadlines.pop_expired(time.monotonic()):
+                await self._expire(token)
+
+    async def _expire(self, token: str):
+        client = self._clients.pop(token, None)
+        on_expire = self._on_expire.pop(token, None)
+        if client is None or on_expire is None:
+            return
+        try:
+            await on_expire(client)
+        except Exception as e:
+            logger.exception("Releasing session %s failed: %s", client.label, e)
+
+    async def expire_all(self):
+        """
+        Release every suspended session now (shutdown).
+        """
+        if self._task is not None:
+            self._task.cancel()
+        for token in self._deadlines.pop_expired(float("inf")):
+            await self._expire(token)
+
+
+sessions = SessionStore(settings.SESSION_TTL)
+
+
+def enabled() -> bool:
+    return sessions.ttl > 0
@@ -1,24 +1,42 @@
 import asyncio
+from app.core.config import settings
 from app.core.logging import logger
+from app.nats.subjects import SubjectTrie, is_wildcard
 
 # -------------------------------------------------------------------
-# Global state (protected by lock)
+# Global state
+#
+# Copy-on-write: every subject maps to an IMMUTABLE frozenset that is
+# replaced (never mutated) by writers. Readers on the fan-out path
+# never lock and never copy; writers serialize on _subs_lock.
 # -------------------------------------------------------------------
 
-# subject -> set(ws)
-subscribers: dict[str, set] = {}
+# subject (or wildcard pattern) -> frozenset(ws)   (ws = WsClient)
+subscribers: dict[str, frozenset] = {}
 
-# ws -> set(subject)
+# ws -> set(subject)   (control plane only)
 ws_sets: dict = {}
 
 _subs_lock = asyncio.Lock()
 
+_EMPTY: frozenset = frozenset()
+
+# wildcard patterns with subscribers (`*` / `>`)
+_patterns = SubjectTrie()
+
+# concrete subject -> resolved subscribers (literal + wildcard matches)
+_match_cache: dict[str, frozenset] = {}
+
 
 # -------------------------------------------------------------------
 # Helpers
 # -------------------------------------------------------------------
 
 def ws_label(ws) -> str:
+    label = getattr(ws, "label", None)
+    if label:
+        return label
+
     peer = getattr(ws, "remote_address", None)
     if isinstance(peer, tuple) and len(peer) >= 2:
         peer_repr = f"{peer[0]}:{peer[1]}"
@@ -27,6 +45,25 @@ def ws_label(ws) -> str:
     return f"ws#{id(ws)}@{peer_repr}"
 
 
+def _set_subscribers(subject: str, subs: frozenset):
+    """
+    Publish new snapshot for subject (writers only, under _subs_lock).
+    """
+    if subs:
+        subscribers[subject] = subs
+    else:
+        subscribers.pop(subject, None)
+
+    if is_wildcard(subject):
+        if subs:
+            _patterns.add(subject)
+        else:
+            _patterns.remove(subject)
+        _match_cache.clear()
+    else:
+        _match_cache.pop(subject, None)
+
+
 # -------------------------------------------------------------------
 # Subscription management
 # -------------------------------------------------------------------
@@ -40,16 +77,22 @@ async def add_subscription(subject: str, ws) -> bool:
         False -> subject already had subscribers
     """
     async with _subs_lock:
-        subs = subscribers.setdefault(subject, set())
+        subs = subscribers.get(subject, _EMPTY)
         already = ws in subs
         was_empty = len(subs) == 0
 
-        subs.add(ws)
+        if not already:
+            subs = subs | {ws}
+            _set_subscribers(subject, subs)
         ws_sets.setdefault(ws, set()).add(subject)
 
         logger.info(
-            f"[subs] {subject} <- {ws_label(ws)} "
-            f"({'already' if already else 'new'}) | total={len(subs)}"
+            "[subs] %s <- %s "
+            "(%s) | total=%s",
+            subject,
+            ws_label(ws),
+            'already' if already else 'new',
+            len(subs),
         )
 
         return was_empty and not already
@@ -68,23 +111,75 @@ async def remove_subscription(subject: str, ws) -> bool:
         if not subs or ws not in subs:
             return False
 
-        subs.remove(ws)
+        subs = subs - {ws}
+        _set_subscribers(subject, subs)
         ws_sets.get(ws, set()).discard(subject)
 
         logger.info(
-            f"[subs] {subject} -/-> {ws_label(ws)} | remaining={len(subs)}"
+            "[subs] %s -/-> %s | remaining=%s",
+            subject,
+            ws_label(ws),
+            len(subs),
         )
 
         if not subs:
-            subscribers.pop(subject, None)
             logger.info(
-                f"[subs] Subject {subject} has no remaining WS subscribers"
+                "[subs] Subject %s has no remaining WS subscribers",
+                subject,
             )
             return True
 
         return False
 
 
+async def apply_subscriptions(ws, add=(), remove=()):
+    """
+    Apply a whole subscription diff for ws under ONE lock acquisition.
+
+    Returns:
+        first_subjects:   set[str] -> ws is the FIRST subscriber
+        emptied_subjects: set[str] -> NO subscribers left
+    """
+    first_subjects: set[str] = set()
+    emptied_subjects: set[str] = set()
+
+    async with _subs_lock:
+        ws_subjects = ws_sets.setdefault(ws, set())
+
+        for subject in remove:
+            subs = subscribers.get(subject)
+            if not subs or ws not in subs:
+                continue
+
+            subs = subs - {ws}
+            _set_subscribers(subject, subs)
+            ws_subjects.discard(subject)
+            if not subs:
+                emptied_subjects.add(subject)
+
+        for subject in add:
+            subs = subscribers.get(subject, _EMPTY)
+            ws_subjects.add(subject)
+            if ws in subs:
+                continue
+
+            if not subs:
+                first_subjects.add(subject)
+            _set_subscribers(subject, subs | {ws})
+
+        logger.info(
+            "[subs] %s batch +%s -%s "
+            "| first=%s emptied=%s",
+            ws_label(ws),
+            len(add),
+            len(remove),
+            len(first_subjects),
+            len(emptied_subjects),
+        )
+
+    return first_subjects, emptied_subjects
+
+
 async def remove_ws(ws):
     """
     Remove websocket from ALL subjects.
@@ -99,47 +194,62 @@ async def remove_ws(ws):
 
         for subject in subjects:
             subs = subscribers.get(subject)
-            if not subs:
+            if not subs or ws not in subs:
                 continue
 
-            subs.discard(ws)
+            subs = subs - {ws}
+            _set_subscribers(subject, subs)
             if not subs:
-                subscribers.pop(subject, None)
                 emptied_subjects.add(subject)
 
         logger.info(
-            f"[subs] {ws_label(ws)} removed from {len(subjects)} subjects"
+            "[subs] %s removed from %s subjects",
+            ws_label(ws),
+            len(subjects),
         )
 
         return len(subjects), emptied_subjects
 
 
 # -------------------------------------------------------------------
-# Read helpers (SAFE snapshots)
+# Read helpers (lock-free, immutable snapshots)
 # -------------------------------------------------------------------
 
-async def get_subscribers(subject: str) -> set:
+def get_subscribers(subject: str) -> frozenset:
     """
-    Returns a SNAPSHOT of WS subscribers for subject.
+    Returns the current immutable SNAPSHOT of WS subscribers for a
+    concrete subject, including wildcard subscribers.
+    O(1), no lock, no copy (wildcard matches are cached per subject).
     """
-    async with _subs_lock:
-        return set(subscribers.get(subject, set()))
+    if not _patterns:
+        return subscribers.get(subject, _EMPTY)
+
+    subs = _match_cache.get(subject)
+    if subs is not None:
+        return subs
 
+    subs = subscribers.get(subject, _EMPTY)
+    for pattern in _patterns.match(subject):
+        subs = subs | subscribers[pattern]
 
-async def get_subscribers_for_ws(ws) -> set[str]:
+    if len(_match_cache) >= settings.SUBJECT_MATCH_CACHE_SIZE:
+        del _match_cache[next(iter(_match_cache))]
+    _match_cache[subject] = subs
+    return subs
+
+
+def get_subscribers_for_ws(ws) -> set[str]:
     """
     Returns a SNAPSHOT of subjects for this WS.
     """
-    async with _subs_lock:
-        return set(ws_sets.get(ws, set()))
+    return set(ws_sets.get(ws, ()))
 
 
-async def subscribers_count(subject: str) -> int:
+def subscribers_count(subject: str) -> int:
     """
     Returns number of WS subscribers for subject.
     """
-    async with _subs_lock:
-        return len(subscribers.get(subject, set()))
+    return len(subscribers.get(subject, _EMPTY))
 
 
 # -------------------------------------------------------------------
@@ -0,0 +1,222 @@
+# app/ws/views.py
+"""
+Per-subscription views: field projection + filter expression.
+
+    {"action": "subscribe", "subject": "inverter.42",
+     "fields": ["power", "grid.voltage"], "filter": "power > 1000"}
+
+Fields and filters apply to the message's `data` object when it has one
+(other envelope keys such as `subject` / `type` are kept), otherwise to
+the message itself. Dotted names address nested objects.
+
+Filter grammar: `<field> <op> <literal>` conditions joined by `and` /
+`or` (`and` binds tighter), op one of == != > >= < <=, literals are
+numbers, 'strings', true, false, null. A missing field never matches.
+
+Views are compiled once and interned, so every subscription with the
+same projection shares one View object (and one projected frame per
+message, see Frame.project).
+"""
+import operator
+import re
+import weakref
+
+
+class InvalidView(ValueError):
+    pass
+
+
+_MISSING = object()
+
+_OPS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+
+_LITERALS = {"true": True, "false": False, "null": None}
+
+_TOKEN = re.compile(
+    r"\s*(?:"
+    r"(?P<num>-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)"
+    r"|(?P<str>'[^']*'|\"[^\"]*\")"
+    r"|(?P<op>==|!=|>=|<=|>|<)"
+    r"|(?P<word>[A-Za-z_][\w.-]*)"
+    r")"
+)
+
+
+def _lookup(obj, path: tuple):
+    for key in path:
+        if not isinstance(obj, dict):
+            return _MISSING
+        obj = obj.get(key, _MISSING)
+        if obj is _MISSING:
+            return _MISSING
+    return obj
+
+
+# -------------------------------------------------------------------
+# Filter compilation
+# -------------------------------------------------------------------
+
+def _tokenize(expr: str) -> list[tuple[str, str]]:
+    tokens = []
+    pos = 0
+    expr = expr.strip()
+    while pos < len(expr):
+        match = _TOKEN.match(expr, pos)
+        if match is None or match.end() == pos:
+            raise InvalidView(f"unexpected input at {pos}: {expr[pos:pos + 10]!r}")
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        pos = match.end()
+    return tokens
+
+
+def _literal(kind: str, text: str):
+    if kind == "num":
+        return float(text) if any(c in text for c in ".eE") else int(text)
+    if kind == "str":
+        return text[1:-1]
+    if kind == "word" and text in _LITERALS:
+        return _LITERALS[text]
+    raise InvalidView(f"expected a literal, got {text!r}")
+
+
+def _condition(path: tuple, op, value):
+    def check(obj) -> bool:
+        actual = _lookup(obj, path)
+        if actual is _MISSING:
+            return False
+        try:
+            return op(actual, value)
+        except TypeError:
+            return False
+    return check
+
+
+def compile_filter(expr: str):
+    """
+    Compile filter expression into predicate(obj) -> bool.
+    """
+    tokens = _tokenize(expr)
+    if not tokens:
+        raise InvalidView("empty filter")
+
+    groups: list[list] = [[]]  # OR of ANDs
+    i = 0
+    while True:
+        if i + 3 > len(tokens):
+            raise InvalidView(f"incomplete condition in {expr!r}")
+
+        (field_kind, field), (op_kind, op), (lit_kind, lit) = tokens[i:i + 3]
+        if field_kind != "word" or field in _LITERALS:
+            raise InvalidView(f"expected a field name, got {field!r}")
+        if op_kind != "op":
+            raise InvalidView(f"expected an operator, got {op!r}")
+        groups[-1].append(
+            _condition(tuple(field.split(".")), _OPS[op], _literal(lit_kind, lit))
+        )
+        i += 3
+
+        if i == len(tokens):
+            break
+        joiner = tokens[i][1]
+        if joiner == "and":
+            pass
+        elif joiner == "or":
+            groups.append([])
+        else:
+            raise InvalidView(f"expected 'and' / 'or', got {joiner!r}")
+        i += 1
+
+    def predicate(obj) -> bool:
+        return any(all(check(obj) for check in group) for group in groups)
+
+    return predicate
+
+
+# -------------------------------------------------------------------
+# Views
+# -------------------------------------------------------------------
+
+class View:
+    __slots__ = ("fields", "filter", "_paths", "_predicate", "__weakref__")
+
+    def __init__(self, fields: tuple | None, filter_expr: str | None):
+        self.fields = fields
+        self.filter = filter_expr
+        self._paths = (
+            [(name, tuple(name.split("."))) for name in fields]
+            if fields is not None
+            else None
+        )
+        self._predicate = compile_filter(filter_expr) if filter_expr else None
+
+    def __repr__(self) -> str:
+        return f"View(fields={self.fields}, filter={self.filter!r})"
+
+    def _project(self, obj: dict) -> dict:
+        result: dict = {}
+        for name, path in self._paths:
+            value = _lookup(obj, path)
+            if value is _MISSING:
+                continue
+            target = result
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = value
+        return result
+
+    def apply(self, message):
+        """
+        Returns the projected message, or None if the filter rejects it.
+        """
+        if not isinstance(message, dict):
+            return None if self._predicate is not None else message
+
+        data = message.get("data")
+        nested = isinstance(data, dict)
+        target = data if nested else message
+
+        if self._predicate is not None and not self._predicate(target):
+            return None
+        if self._paths is None:
+            return message
+
+        if nested:
+            return {**message, "data": self._project(data)}
+        return self._project(message)
+
+
+# (fields, filter) -> View, shared by all subscriptions using it
+_views: "weakref.WeakValueDictionary" = weakref.WeakValueDictionary()
+
+
+def get_view(fields=None, filter_expr=None) -> View | None:
+    """
+    Interned View for fields / filter (None if both are empty).
+    Raises InvalidView for malformed input.
+    """
+    if fields is not None:
+        if not isinstance(fields, list) or not all(
+            isinstance(f, str) and f for f in fields
+        ):
+            raise InvalidView("fields must be a list of field names")
+        fields = tuple(dict.fromkeys(fields)) or None
+    if filter_expr is not None and not isinstance(filter_expr, str):
+        raise InvalidView("filter must be a string")
+    filter_expr = (filter_expr or "").strip() or None
+
+    if fields is None and filter_expr is None:
+        return None
+
+    key = (fields, filter_expr)
+    view = _views.get(key)
+    if view is None:
+        view = _views[key] = View(fields, filter_expr)
+    return view
@@ -1,126 +1,419 @@
-import json
+import asyncio
+from functools import partial
+
+from app.core.config import settings
 from app.core.logging import logger
 
 from app.ws.subscriptions import (
-    add_subscription,
-    remove_subscription,
+    apply_subscriptions,
     get_subscribers_for_ws,
     remove_ws,
     register_client,
     ws_label,
 )
 
-from app.nats.publisher import publish_event
+from app.ws import commands
+from app.ws.client import WsClient
+from app.ws.codecs import CODECS, JSON, decode_message, get_codec
+from app.ws.history import INSTANCE_ID
+from app.ws.sessions import sessions
+from app.ws.send import (
+    control_frame,
+    deliver_history,
+    deliver_last_values,
+    prefetch_history,
+    send_control,
+)
+from app.ws.options import (
+    InvalidOptions,
+    ReplayRequest,
+    SubscriptionOptions,
+    parse_batching,
+    parse_replays,
+    parse_subscriptions,
+)
+from app.nats import linger
+from app.nats.interest import announce_start, announce_stop
+from app.nats.status_store import device_status
+from app.nats.subjects import is_valid_subject
+
+
+def _valid_subjects(ws, requested: dict) -> dict:
+    valid = {}
+    for subject, options in requested.items():
+        if is_valid_subject(subject):
+            valid[subject] = options
+        else:
+            logger.warning("%s invalid subject: %s", ws_label(ws), subject)
+    return valid
+
+
+async def _start_subjects(nats_manager, subjects):
+    """
+    First WS subscriber(s): REAL NATS start + control event, batched.
+    Subjects still lingering were never stopped and are skipped.
+    """
+    subjects = linger.resume(subjects)
+    if not subjects:
+        return
+    await nats_manager.start_many(subjects)
+    await announce_start(subjects)
+
+
+async def _stop_subjects(nats_manager, subjects):
+    """
+    Last WS subscriber(s) gone: REAL NATS stop + control event, batched,
+    after the linger grace period when enabled.
+    """
+    if not subjects or linger.defer(subjects):
+        return
+    await nats_manager.stop_many(subjects)
+    await announce_stop(subjects)
+
+
+async def _prefetch(replays: dict) -> dict:
+    """
+    JetStream fallback frames for replays, fetched BEFORE subscribing.
+    """
+    if not replays:
+        return {}
+    fetched = await asyncio.gather(
+        *(prefetch_history(subject, replay) for subject, replay in replays.items())
+    )
+    return dict(zip(replays, fetched))
+
+
+async def _release(nats_manager, client: WsClient) -> int:
+    """
+    Drop client from the registry; stop subjects nobody else wants.
+    Returns the number of subjects it was subscribed to.
+    """
+    sessions.drop(client)
+    removed_count, emptied_subjects = await remove_ws(client)
+    await client.close()
+
+    await _stop_subjects(nats_manager, emptied_subjects)   # 🔥 REAL STOP
+    return removed_count
+
+
+async def _expire_session(nats_manager, client: WsClient):
+    removed_count = await _release(nats_manager, client)
+    logger.info(
+        "Session of %s expired, removed from %s subjects (dropped=%s)",
+        client.label,
+        removed_count,
+        client.dropped,
+    )
+
+
+async def _resume(ws, client: WsClient, token) -> WsClient:
+    """
+    Swap a suspended session in for the fresh client of this connection.
+    Returns the client serving the connection from now on.
+    """
+    if get_subscribers_for_ws(client):
+        send_control(client, {
+            "type": "error",
+            "error": "resume must precede subscriptions",
+        })
+        return client
+
+    session = sessions.resume(token)
+    if session is None:
+        send_control(client, {"type": "error", "error": "unknown or expired session"})
+        return client
+
+    sessions.drop(client)
+    await remove_ws(client)
+    await client.close()
+
+    # negotiated on this connection (subprotocol / hello)
+    session.codec = client.codec
+    session.batch_window = client.batch_window
+    session.batch_max = client.batch_max
+    session.publish_prefixes = client.publish_prefixes
+
+    # queued after the buffered frames: marks the end of the backlog
+    session.attach(ws, control_frame({
+        "type": "resumed",
+        "token": session.session,
+        "subjects": len(get_subscribers_for_ws(session)),
+    }))
+    logger.info("%s resumed session (%s buffered)", ws_label(ws), session.queued)
+    return session
 
 
 async def websocket_handler(ws, nats_manager):
     # ---------------------------------------------------------
-    # Register WS connection
+    # Register WS connection (+ dedicated writer)
     # ---------------------------------------------------------
-    await register_client(ws)
-    logger.info(f"Client connected {ws_label(ws)}")
+    client = WsClient(ws, get_codec(getattr(ws, "subprotocol", None)) or JSON)
+    client.start()
+    await register_client(client)
+    logger.info("Client connected %s (codec=%s)", ws_label(ws), client.codec.name)
+
+    if sessions.ttl > 0:
+        send_control(client, {
+            "type": "session",
+            "token": sessions.issue(client),
+            "ttl": sessions.ttl,
+        })
 
     try:
         async for raw in ws:
             try:
-                data = json.loads(raw)
+                data = decode_message(raw, client.codec)
                 action = data.get("action")
 
+                # =================================================
+                # HELLO (CODEC / BATCHING NEGOTIATION)
+                # =================================================
+                if action == "hello":
+                    # validated before anything is applied
+                    batching = None
+                    if "batch_ms" in data or "batch_max" in data:
+                        batching = parse_batching(data, client.batch_window * 1000)
+
+                    # no "codec" -> keep the negotiated one (subprotocol)
+                    if "codec" in data:
+                        name = data["codec"]
+                        codec = get_codec(name)
+                        if codec is None:
+                            logger.warning(
+                                "%s requested unsupported codec: %s",
+                                ws_label(ws),
+                                name,
+                            )
+                        else:
+                            client.codec = codec
+
+                    if batching is not None:
+                        client.set_batching(*batching)
+
+                    if "publish_prefixes" in data:
+                        client.publish_prefixes = commands.narrow(
+                            data["publish_prefixes"]
+                        )
+
+                    send_control(client, {
+                        "type": "hello",
+                        "codec": client.codec.name,
+                        "codecs": list(CODECS),
+                        "batch_ms": client.batch_window * 1000,
+                        "batch_max": client.batch_max,
+                        "instance": INSTANCE_ID,
+                        "publish_prefixes": list(commands.prefixes_for(client)),
+                    })
+
+                # =================================================
+                # RESUME (SESSION TOKEN)
+                # =================================================
+                elif action == "resume":
+                    client = await _resume(ws, client, data.get("token"))
+
                 # =================================================
                 # SINGLE SUBSCRIBE
                 # =================================================
-                if action == "subscribe":
+                elif action == "subscribe":
                     subject = data.get("subject")
                     if not subject:
                         logger.warning(
-                            f"{ws_label(ws)} subscribe without subject"
+                            "%s subscribe without subject",
+                            ws_label(ws),
+                        )
+                        continue
+
+                    if not is_valid_subject(subject):
+                        logger.warning(
+                            "%s invalid subject: %s",
+                            ws_label(ws),
+                            subject,
                         )
                         continue
 
-                    is_first = await add_subscription(subject, ws)
+                    options = SubscriptionOptions.from_request(data)
+                    replay = ReplayRequest.from_request(data, subject)
+                    prefetched = (
+                        await prefetch_history(subject, replay) if replay else []
+                    )
 
-                    # 🔥 KLUCZOWA POPRAWKA
-                    if is_first:
-                        await nats_manager.start(subject)     # REALNY START
-                        await publish_event(subject, "start") # EVENT INFO
+                    is_new = subject not in get_subscribers_for_ws(client)
+
+                    client.set_options(subject, options)
+                    first, _ = await apply_subscriptions(client, add=[subject])
+
+                    # no await between registering and replaying
+                    if replay:
+                        deliver_history(client, subject, replay, prefetched)
+                    elif is_new:
+                        deliver_last_values(client, [subject])
+
+                    await _start_subjects(nats_manager, first)
 
                     logger.info(
-                        f"{ws_label(ws)} subscribed to {subject}"
+                        "%s subscribed to %s",
+                        ws_label(ws),
+                        subject,
                     )
 
                 # =================================================
                 # SUBSCRIBE MANY (FULL REPLACE – SOURCE OF TRUTH)
                 # =================================================
                 elif action == "subscribe_many":
-                    subjects = set(data.get("subjects", []))
-                    current = await get_subscribers_for_ws(ws)
+                    requested = _valid_subjects(ws, parse_subscriptions(data))
+                    replays = {
+                        subject: replay
+                        for subject, replay in parse_replays(data).items()
+                        if subject in requested
+                    }
+                    prefetched = await _prefetch(replays)
+
+                    subjects = set(requested)
+                    current = get_subscribers_for_ws(client)
 
-                    # -----------------------------
-                    # Unsubscribe removed subjects
-                    # -----------------------------
+                    for subject, options in requested.items():
+                        client.set_options(subject, options)
                     for subject in current - subjects:
-                        emptied = await remove_subscription(subject, ws)
-                        if emptied:
-                            await nats_manager.stop(subject)   # REAL STOP
-                            await publish_event(subject, "stop")
-
-                    # -----------------------------
-                    # Subscribe new subjects
-                    # -----------------------------
-                    for subject in subjects - current:
-                        is_first = await add_subscription(subject, ws)
-                        if is_first:
-                            await nats_manager.start(subject)
-                            await publish_event(subject, "start")
+                        client.drop_options(subject)
+
+                    # whole diff in one registry pass
+                    first, emptied = await apply_subscriptions(
+                        client,
+                        add=subjects - current,
+                        remove=current - subjects,
+                    )
+
+                    # no await between registering and replaying
+                    for subject, replay in replays.items():
+                        deliver_history(
+                            client, subject, replay, prefetched[subject]
+                        )
+                    deliver_last_values(client, subjects - current - set(replays))
+
+                    await _stop_subjects(nats_manager, emptied)
+                    await _start_subjects(nats_manager, first)
 
                     logger.info(
-                        f"{ws_label(ws)} subscribe_many -> {list(subjects)}"
+                        "%s subscribe_many -> %s",
+                        ws_label(ws),
+                        list(subjects),
                     )
 
                 # =================================================
                 # UNSUBSCRIBE MANY (EXPLICIT)
                 # =================================================
                 elif action == "unsubscribe_many":
-                    subjects = set(data.get("subjects", []))
+                    subjects = set(parse_subscriptions(data))
 
                     for subject in subjects:
-                        emptied = await remove_subscription(subject, ws)
-                        if emptied:
-                            await nats_manager.stop(subject)
-                            await publish_event(subject, "stop")
+                        client.drop_options(subject)
+                    _, emptied = await apply_subscriptions(
+                        client, remove=subjects
+                    )
+                    await _stop_subjects(nats_manager, emptied)
 
                     logger.info(
-                        f"{ws_label(ws)} unsubscribe_many -> {list(subjects)}"
+                        "%s unsubscribe_many -> %s",
+                        ws_label(ws),
+                        list(subjects),
                     )
 
+                # =================================================
+                # DEVICE STATUS (BULK QUERY)
+                # =================================================
+                elif action == "get_status_many":
+                    uuids = data.get("uuids")
+                    error = None
+                    if not isinstance(uuids, list) or not all(
+                        isinstance(u, str) for u in uuids
+                    ):
+                        error = "uuids must be a list of strings"
+                    elif len(uuids) > settings.STATUS_QUERY_MAX:
+                        error = f"at most {settings.STATUS_QUERY_MAX} uuids per request"
+
+                    if error is not None:
+                        logger.warning(
+                            "Invalid status query from %s: %s",
+                            ws_label(ws),
+                            error,
+                        )
+                        send_control(client, {"type": "error", "error": error})
+                    else:
+                        send_control(client, {
+                            "type": "status_many",
+                            "statuses": device_status.get_many(uuids),
+                        })
+
+                # =================================================
+                # WS -> NATS (PUBLISH / REQUEST)
+                # =================================================
+                elif action == "publish":
+                    await commands.publish(client, data)
+
+                elif action == "request":
+                    # reply is delivered later (not awaited here)
+                    commands.request(client, data)
+
                 # =================================================
                 # UNKNOWN ACTION
                 # =================================================
                 else:
                     logger.warning(
-                        f"{ws_label(ws)} unknown action: {action}"
+                        "%s unknown action: %s",
+                        ws_label(ws),
+                        action,
                     )
 
-            except json.JSONDecodeError:
+            except InvalidOptions as e:
+                logger.warning(
+                    "Invalid options from %s: %s",
+                    ws_label(ws),
+                    e,
+                )
+                send_control(client, {"type": "error", "error": str(e)})
+            except ValueError:
                 logger.warning(
-                    f"Invalid JSON from {ws_label(ws)}: {raw}"
+                    "Undecodable message from %s: %r",
+                    ws_label(ws),
+                    raw,
                 )
             except Exception as e:
                 logger.exception(
-                    f"Bad WS message from {ws_label(ws)}: {e}"
+                    "Bad WS message from %s: %s",
+                    ws_label(ws),
+                    e,
                 )
 
     finally:
         # ---------------------------------------------------------
-        # Cleanup WS on disconnect
+        # Cleanup WS on disconnect (or keep the session)
         # ---------------------------------------------------------
-        removed_count, emptied_subjects = await remove_ws(ws)
+        kept = False
+        if client.session is not None and not client.evicted:
+            await client.detach(settings.SESSION_BUFFER)
+            kept = sessions.suspend(client, partial(_expire_session, nats_manager))
 
-        for subject in emptied_subjects:
-            await nats_manager.stop(subject)   # 🔥 REAL STOP
-            await publish_event(subject, "stop")
+        if kept:
+            logger.info(
+                "Client disconnected %s, session kept for %ss "
+                "(sent=%s, failed=%s, dropped=%s)",
+                ws_label(ws),
+                sessions.ttl,
+                client.sent,
+                client.failed,
+                client.dropped,
+            )
+        else:
+            removed_count = await _release(nats_manager, client)
 
-        logger.info(
-            f"Client disconnected {ws_label(ws)}, "
-            f"removed from {removed_count} subjects"
-        )
+            logger.info(
+                "Client disconnected %s, "
+                "removed from %s subjects "
+                "(sent=%s, failed=%s, "
+                "dropped=%s)",
+                ws_label(ws),
+                removed_count,
+                client.sent,
+                client.failed,
+                client.dropped,
+            )
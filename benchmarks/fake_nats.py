@@ -0,0 +1,97 @@
+# benchmarks/fake_nats.py
+import asyncio
+
+from app.nats.subjects import SubjectTrie
+
+
+class FakeMsg:
+    __slots__ = ("subject", "data", "reply", "headers")
+
+    def __init__(self, subject: str, data: bytes, reply: str = "", headers=None):
+        self.subject = subject
+        self.data = data
+        self.reply = reply
+        self.headers = headers
+
+
+class FakeSubscription:
+    """
+    Like a nats-py subscription: messages are queued and the callback
+    runs in the subscription's own task, one message at a time.
+    """
+
+    def __init__(self, nc: "FakeNats", subject: str, cb):
+        self._nc = nc
+        self.subject = subject
+        self._cb = cb
+        self._pending: asyncio.Queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            msg = await self._pending.get()
+            try:
+                await self._cb(msg)
+            except Exception:
+                pass
+            self._nc.delivered += 1
+
+    def deliver(self, msg: FakeMsg):
+        self._pending.put_nowait(msg)
+
+    async def unsubscribe(self):
+        self._task.cancel()
+        self._nc._remove(self)
+
+
+class FakeNats:
+    """
+    In-process stand-in for the NATS Core client (`subscribe`, `publish`,
+    `flush`, `close`). Subject matching follows NATS rules, so wildcard
+    and broad subscriptions behave as against a real server.
+    """
+
+    def __init__(self):
+        # subject / pattern -> subscriptions
+        self._subs: dict[str, set[FakeSubscription]] = {}
+        self._patterns = SubjectTrie()
+
+        # counters
+        self.published = 0
+        self.delivered = 0
+        self.subscribes = 0
+
+    @property
+    def is_connected(self) -> bool:
+        return True
+
+    async def subscribe(self, subject: str, cb=None, **kwargs) -> FakeSubscription:
+        self.subscribes += 1
+        sub = FakeSubscription(self, subject, cb)
+        self._subs.setdefault(subject, set()).add(sub)
+        self._patterns.add(subject)
+        return sub
+
+    def _remove(self, sub: FakeSubscription):
+        subs = self._subs.get(sub.subject)
+        if subs is None:
+            return
+        subs.discard(sub)
+        if not subs:
+            del self._subs[sub.subject]
+            self._patterns.remove(sub.subject)
+
+    async def publish(self, subject: str, payload: bytes = b"", reply: str = "", headers=None):
+        self.published += 1
+        msg = FakeMsg(subject, payload, reply, headers)
+        for pattern in self._patterns.match(subject):
+            for sub in self._subs[pattern]:
+                sub.deliver(msg)
+
+    async def flush(self, timeout: float = 2.0):
+        return None
+
+    async def close(self):
+        for subs in list(self._subs.values()):
+            for sub in list(subs):
+                await sub.unsubscribe()
@@ -0,0 +1,507 @@
+# benchmarks/gateway_load.py
+"""
+End-to-end load test of the gateway against an in-process NATS stand-in.
+
+The gateway components (subscription manager, WS handler, fan-out) run in
+this process on top of FakeNats; WS clients run in separate worker
+processes so they do not compete with the gateway for its event loop.
+
+Every published payload carries its wall-clock publish time, so clients
+measure NATS-publish -> WS-receive latency. Results are written as JSON;
+pass --baseline with a previous result file to fail on regressions.
+
+    python -m benchmarks.gateway_load --clients 2000 --rate 5000
+    python -m benchmarks.gateway_load --baseline benchmarks/results/prev.json
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+# quiet, throw-away logging unless asked otherwise (read at app import)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("LOG_DIR", os.path.join(tempfile.gettempdir(), "gateway-bench"))
+os.environ.setdefault("METRICS_ENABLED", "false")
+
+import websockets  # noqa: E402
+
+SUBJECT_PREFIX = "bench.dev"
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+# (result key, True if higher is better)
+COMPARED = [
+    ("delivered_per_s", True),
+    ("latency_ms.p50", False),
+    ("latency_ms.p99", False),
+    ("gateway_cpu_percent", False),
+    ("rss_per_connection_kb", False),
+]
+
+
+def _raise_nofile():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # peak RSS (KB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return sorted_values[index]
+
+
+def _subjects_for(rng: random.Random, cfg: dict) -> list[str]:
+    count = min(cfg["subs_per_client"], cfg["subjects"])
+    return [
+        f"{SUBJECT_PREFIX}.{i}"
+        for i in rng.sample(range(cfg["subjects"]), count)
+    ]
+
+
+# -------------------------------------------------------------------
+# Client side (worker processes)
+# -------------------------------------------------------------------
+
+class _ClientStats:
+    """
+    Received-frame counters and a reservoir sample of latencies.
+    """
+
+    def __init__(self, capacity: int, rng: random.Random):
+        self._capacity = capacity
+        self._rng = rng
+        self.samples: list[float] = []
+        self.seen = 0
+        self.received = 0
+        self.replays = 0
+        self.churn_ops = 0
+        self.errors = 0
+
+    def record(self, latency: float):
+        self.received += 1
+        self.seen += 1
+        if len(self.samples) < self._capacity:
+            self.samples.append(latency)
+            return
+        i = self._rng.randrange(self.seen)
+        if i < self._capacity:
+            self.samples[i] = latency
+
+    def to_dict(self) -> dict:
+        return {
+            "received": self.received,
+            "replays": self.replays,
+            "churn_ops": self.churn_ops,
+            "errors": self.errors,
+            "samples": self.samples,
+            "cpu_seconds": _cpu_seconds(),
+        }
+
+
+async def _client(cid: int, ws, cfg: dict, stats: _ClientStats, stopping):
+    rng = random.Random(cfg["seed"] * 1_000_003 + cid)
+    # frames published before our latest subscribe are LVC replays
+    subscribed_at = time.time()
+
+    async def subscribe():
+        nonlocal subscribed_at
+        subscribed_at = time.time()
+        await ws.send(json.dumps({
+            "action": "subscribe_many",
+            "subjects": _subjects_for(rng, cfg),
+        }))
+
+    async def churn():
+        while not stopping.is_set():
+            await asyncio.sleep(cfg["churn"] * (0.5 + rng.random()))
+            await subscribe()
+            stats.churn_ops += 1
+
+    if cfg["batch_ms"] > 0:
+        await ws.send(json.dumps({"action": "hello", "batch_ms": cfg["batch_ms"]}))
+
+    await subscribe()
+    churn_task = asyncio.create_task(churn()) if cfg["churn"] > 0 else None
+    try:
+        async for raw in ws:
+            messages = json.loads(raw)
+            if not isinstance(messages, list):
+                messages = [messages]
+
+            for message in messages:
+                data = message.get("data")
+                if not isinstance(data, dict) or "ts" not in data:
+                    continue
+                if data["ts"] < subscribed_at:
+                    stats.replays += 1
+                elif not data.get("warmup"):
+                    stats.record(time.time() - data["ts"])
+    except websockets.ConnectionClosed:
+        pass
+    except Exception:
+        stats.errors += 1
+    finally:
+        if churn_task is not None:
+            churn_task.cancel()
+
+
+async def _client_main(port: int, ids: list[int], cfg: dict, results, stop):
+    _raise_nofile()
+    stats = _ClientStats(cfg["samples"], random.Random(cfg["seed"] + ids[0]))
+    stopping = asyncio.Event()
+    connect_slots = asyncio.Semaphore(100)
+    conns = []
+    tasks = []
+
+    async def connect(cid):
+        async with connect_slots:
+            ws = await websockets.connect(
+                f"ws://127.0.0.1:{port}",
+                ping_interval=None,
+                max_queue=None,
+            )
+        conns.append(ws)
+        tasks.append(asyncio.create_task(_client(cid, ws, cfg, stats, stopping)))
+
+    await asyncio.gather(*(connect(cid) for cid in ids))
+    results.put(("ready", len(conns)))
+
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, stop.wait)
+
+    stopping.set()
+    await asyncio.gather(*(ws.close() for ws in conns), return_exceptions=True)
+    await asyncio.gather(*tasks, return_exceptions=True)
+    results.put(("done", stats.to_dict()))
+
+
+def client_worker(port: int, ids: list[int], cfg: dict, results, stop):
+    asyncio.run(_client_main(port, ids, cfg, results, stop))
+
+
+# -------------------------------------------------------------------
+# Gateway side
+# -------------------------------------------------------------------
+
+async def _publish(nc, cfg: dict, seconds: float, warmup: bool) -> int:
+    """
+    Publish round-robin over all subjects at cfg["rate"] msg/s.
+    """
+    tick = 0.01
+    per_tick = cfg["rate"] * tick
+    budget = 0.0
+    published = 0
+    seq = 0
+
+    started = time.perf_counter()
+    next_tick = started
+    while time.perf_counter() - started < seconds:
+        budget += per_tick
+        while budget >= 1:
+            budget -= 1
+            subject = f"{SUBJECT_PREFIX}.{seq % cfg['subjects']}"
+            payload = {"ts": time.time(), "seq": seq, "pad": cfg["pad"]}
+            if warmup:
+                payload["warmup"] = True
+            await nc.publish(subject, json.dumps(payload).encode())
+            published += 1
+            seq += 1
+
+        next_tick += tick
+        await asyncio.sleep(max(0.0, next_tick - time.perf_counter()))
+    return published
+
+
+async def _wait_for(queue, kind: str, count: int) -> list:
+    loop = asyncio.get_running_loop()
+    items = []
+    while len(items) < count:
+        got, value = await loop.run_in_executor(None, queue.get)
+        if got == kind:
+            items.append(value)
+    return items
+
+
+async def run(cfg: dict) -> dict:
+    from app.core.config import settings
+    from app.core.metrics import ws_frames_dropped, ws_frames_out, ws_send_failed
+    from app.main import on_nats_msg
+    from app.nats.publisher import set_nats_client
+    from app.nats.subscription_manager import NatsSubscriptionManager
+    from app.ws.codecs import SUBPROTOCOLS
+    from app.ws.compression import serve_options
+    from app.ws.websocket_handler import websocket_handler
+    from benchmarks.fake_nats import FakeNats
+
+    _raise_nofile()
+
+    nc = FakeNats()
+    set_nats_client(nc)
+    manager = NatsSubscriptionManager(
+        nc,
+        on_nats_msg,
+        broad_subjects=settings.NATS_BROAD_SUBJECTS,
+    )
+    await manager.start_broad()
+
+    server = await websockets.serve(
+        lambda ws: websocket_handler(ws, manager),
+        host="127.0.0.1",
+        port=0,
+        ping_interval=None,
+        max_queue=32,
+        subprotocols=SUBPROTOCOLS,
+        **serve_options(),
+    )
+    port = server.sockets[0].getsockname()[1]
+
+    # -------------------------------------------------
+    # Connect clients
+    # -------------------------------------------------
+    rss_idle = _rss_bytes()
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    stop = ctx.Event()
+    workers = []
+    for w in range(cfg["workers"]):
+        ids = list(range(w, cfg["clients"], cfg["workers"]))
+        if not ids:
+            continue
+        proc = ctx.Process(
+            target=client_worker,
+            args=(port, ids, cfg, results, stop),
+            daemon=True,
+        )
+        proc.start()
+        workers.append(proc)
+
+    connected = sum(await _wait_for(results, "ready", len(workers)))
+    await asyncio.sleep(cfg["settle"])
+    rss_connected = _rss_bytes()
+
+    # -------------------------------------------------
+    # Warm-up + measured window
+    # -------------------------------------------------
+    if cfg["warmup"] > 0:
+        await _publish(nc, cfg, cfg["warmup"], warmup=True)
+
+    frames_out = ws_frames_out.value()
+    dropped = ws_frames_dropped.value()
+    failed = ws_send_failed.value()
+    cpu_start = _cpu_seconds()
+    started = time.perf_counter()
+
+    published = await _publish(nc, cfg, cfg["duration"], warmup=False)
+    await asyncio.sleep(cfg["drain"])
+
+    elapsed = time.perf_counter() - started
+    cpu = _cpu_seconds() - cpu_start
+    frames_out = ws_frames_out.value() - frames_out
+    dropped = ws_frames_dropped.value() - dropped
+    failed = ws_send_failed.value() - failed
+    rss_loaded = _rss_bytes()
+
+    # -------------------------------------------------
+    # Collect
+    # -------------------------------------------------
+    stop.set()
+    reports = await _wait_for(results, "done", len(workers))
+    for proc in workers:
+        proc.join(timeout=10)
+
+    server.close()
+    await server.wait_closed()
+    await nc.close()
+
+    samples = sorted(s for report in reports for s in report["samples"])
+    received = sum(report["received"] for report in reports)
+
+    return {
+        "published": published,
+        "published_per_s": round(published / cfg["duration"], 1),
+        "received": received,
+        "delivered_per_s": round(received / elapsed, 1),
+        "frames_out": frames_out,
+        "frames_dropped": dropped,
+        "send_failed": failed,
+        "replays": sum(report["replays"] for report in reports),
+        "churn_ops": sum(report["churn_ops"] for report in reports),
+        "client_errors": sum(report["errors"] for report in reports),
+        "connected": connected,
+        "nats_subscribes": nc.subscribes,
+        "latency_ms": {
+            "p50": round(_percentile(samples, 0.50) * 1000, 3),
+            "p90": round(_percentile(samples, 0.90) * 1000, 3),
+            "p99": round(_percentile(samples, 0.99) * 1000, 3),
+            "max": round(samples[-1] * 1000, 3) if samples else 0.0,
+            "samples": len(samples),
+        },
+        "gateway_cpu_percent": round(100 * cpu / elapsed, 1),
+        "client_cpu_seconds": round(sum(r["cpu_seconds"] for r in reports), 2),
+        "rss_mb": {
+            "idle": round(rss_idle / 1e6, 1),
+            "connected": round(rss_connected / 1e6, 1),
+            "loaded": round(rss_loaded / 1e6, 1),
+        },
+        "rss_per_connection_kb": round(
+            (rss_connected - rss_idle) / max(1, connected) / 1024, 2
+        ),
+    }
+
+
+# -------------------------------------------------------------------
+# Reporting
+# -------------------------------------------------------------------
+
+def _environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(__file__),
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "loop_policy": type(asyncio.get_event_loop_policy()).__module__,
+    }
+
+
+def _lookup(results: dict, key: str):
+    value = results
+    for part in key.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Returns the list of metrics that regressed by more than tolerance.
+    """
+    if current["config"] != baseline.get("config"):
+        print("  warning: baseline was run with a different config")
+
+    regressions = []
+    for key, higher_is_better in COMPARED:
+        new = _lookup(current["results"], key)
+        old = _lookup(baseline["results"], key)
+        if not isinstance(new, (int, float)) or not old:
+            continue
+
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = "REGRESSION" if worse > tolerance else ""
+        print(f"  {key:<24} {old:>12} -> {new:>12}  ({change:+.1%}) {flag}")
+        if flag:
+            regressions.append(key)
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--subjects", type=int, default=500)
+    parser.add_argument("--subs-per-client", type=int, default=5)
+    parser.add_argument("--rate", type=float, default=2000, help="published msg/s")
+    parser.add_argument("--pad", default="x" * 64, help="payload padding")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--settle", type=float, default=1.0)
+    parser.add_argument("--drain", type=float, default=1.0)
+    parser.add_argument(
+        "--churn", type=float, default=5.0,
+        help="mean seconds between subscribe_many per client (0 = off)",
+    )
+    parser.add_argument(
+        "--batch-ms", type=float, default=0.0,
+        help="client micro-batching window (0 = off)",
+    )
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--samples", type=int, default=20_000, help="latency samples per worker")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="result file (default: benchmarks/results/<utc>.json)")
+    parser.add_argument("--baseline", help="previous result file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    cfg = {
+        "clients": args.clients,
+        "subjects": args.subjects,
+        "subs_per_client": args.subs_per_client,
+        "rate": args.rate,
+        "pad": args.pad,
+        "duration": args.duration,
+        "warmup": args.warmup,
+        "settle": args.settle,
+        "drain": args.drain,
+        "churn": args.churn,
+        "batch_ms": args.batch_ms,
+        "workers": args.workers,
+        "samples": args.samples,
+        "seed": args.seed,
+    }
+
+    from app.core import loop
+
+    results = loop.run(run(cfg))
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": cfg,
+        "environment": _environment(),
+        "results": results,
+    }
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        output = os.path.join(RESULTS_DIR, f"{stamp}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(json.dumps(results, indent=2))
+    print(f"saved -> {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"compared to {args.baseline}:")
+        if compare(report, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())